@@ -0,0 +1,199 @@
+######################################################################
+#  CliNER - benchmarks/hashing.py                                    #
+#                                                                    #
+#  Purpose: Compare DictVectorizer models against feature-hashing    #
+#               models (accuracy; size, load time and RSS of the     #
+#               saved bundle, next to a plain pickle).               #
+######################################################################
+
+
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import subprocess
+import cPickle as pickle
+
+sys.path.append( os.path.join(os.environ['CLINER_DIR'], 'cliner') )
+
+import helper
+from model import Model
+from notes.note import Note
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-t", dest="txt", help="Training text files")
+    parser.add_argument("-c", dest="con", help="Training concept files")
+    parser.add_argument("-e", dest="test_txt", help="Held-out text files")
+    parser.add_argument("-g", dest="test_con", help="Held-out concept files")
+    parser.add_argument("-f", dest="format", default='i2b2',
+        help="Data format ( " + ' | '.join(Note.supportedFormats()) + " )")
+    parser.add_argument("-d", dest="dims", default='18,20,22',
+        help="Comma separated log2 hash dimensions to compare")
+
+    args = parser.parse_args()
+
+    train_notes = read_notes(args.txt     , args.con     , args.format)
+    test_notes  = read_notes(args.test_txt, args.test_con, args.format)
+
+    configs = [ ('DictVectorizer', None) ]
+    for d in args.dims.split(','):
+        configs.append( ('hash 2^%s' % d, 2**int(d)) )
+
+    results = []
+    for name,hash_features in configs:
+        model = Model(hash_features=hash_features)
+        model.train(train_notes)
+        results.append( (name,) + measure(model, test_notes) )
+
+    print
+    print '%-16s %8s %8s %11s %11s %11s %11s %11s %11s' % (
+              'vectorizer', 'iob acc', 'con acc',
+              'bundle(MB)', 'load (s)', 'RSS (MB)',
+              'pickle(MB)', 'load (s)', 'RSS (MB)')
+    for row in results:
+        print '%-16s %8.4f %8.4f %11.2f %11.3f %11.2f %11.2f %11.3f %11.2f' % row
+
+
+
+def read_notes(txt_glob, con_glob, format):
+
+    txt_files = helper.map_files(glob.glob(txt_glob))
+    con_files = helper.map_files(glob.glob(con_glob))
+
+    notes = []
+    for k in sorted(txt_files):
+        if k in con_files:
+            note = Note(format)
+            note.read(txt_files[k], con_files[k])
+            notes.append(note)
+    return notes
+
+
+
+def measure(model, notes):
+
+    """
+    measure()
+
+    @param model. A trained Model
+    @param notes. Held-out gold standard notes
+    @return       tuple: (IOB token accuracy, concept accuracy on gold chunks)
+                         followed by (size in MB, Model.load time in seconds,
+                         resident memory of the loaded model in MB) for the
+                         saved bundle, then the same for a pickled Model
+    """
+
+    # Pass one: token-level IOB accuracy
+    data = []
+    gold = []
+    for note in notes:
+        data += note.getTokenizedSentences()
+        gold += note.getIOBLabels()
+    iobs,_,__ = model.first_predict(data)
+    pairs = [ (p,g) for psent,gsent in zip(iobs,gold) for p,g in zip(psent,gsent) ]
+    iob_acc = sum( [ p == g for p,g in pairs ] ) / float(len(pairs) or 1)
+
+    # Pass two: concept accuracy given gold chunks
+    chunks = []
+    inds   = []
+    labels = []
+    for note in notes:
+        chunks += note.getChunkedText()
+        inds   += note.getConceptIndices()
+        labels += note.getConceptLabels()
+    predicted = [ c[0] for c in model.second_predict(chunks, inds) ]
+    con_acc = sum( [ p == g for p,g in zip(predicted,labels) ] ) / float(len(labels) or 1)
+
+    # The files train.py writes (a bundle), and a plain pickle for comparison
+    tmp_dir = os.path.join(os.environ['CLINER_DIR'], 'cliner/tmp_files_dir')
+    bundle  = measure_saved(model, os.path.join(tmp_dir, 'bench.bundle'), False)
+    pickled = measure_saved(model, os.path.join(tmp_dir, 'bench.pickle'), True )
+
+    return (iob_acc, con_acc) + bundle + pickled
+
+
+
+def measure_saved(model, path, as_pickle):
+
+    """
+    measure_saved()
+
+    @param model.     A trained Model
+    @param path.      Where to save it (removed afterwards)
+    @param as_pickle. Pickle the Model instead of model.save() (a bundle)
+    @return           tuple: (size in MB, Model.load time in seconds,
+                              resident memory of the loaded model in MB)
+    """
+
+    if as_pickle:
+        with open(path, 'wb') as f:
+            pickle.dump(model, f, -1)
+    else:
+        model.save(path)
+
+    try:
+        size = disk_size(path) / float(2**20)
+
+        start = time.time()
+        Model.load(path)
+        load_time = time.time() - start
+
+        rss = load_rss(path)
+    finally:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    return size, load_time, rss
+
+
+
+def disk_size(path):
+    """ Bytes in a file, or in every file of a directory (a bundle) """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum( os.path.getsize(os.path.join(path,f)) for f in os.listdir(path) )
+
+
+
+# Run in a fresh interpreter, so earlier models don't count towards the peak
+RSS_SCRIPT = '''
+import os, sys, resource
+sys.path.append( os.path.join(os.environ['CLINER_DIR'], 'cliner') )
+from model import Model
+import notes.note
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+obj = Model.load(sys.argv[1])
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print after - before
+'''
+
+
+def load_rss(filename):
+
+    """
+    load_rss()
+
+    @param filename. A saved model (bundle or pickle)
+    @return          Growth in peak resident memory (MB) from Model.load,
+                     measured in a subprocess (imports are not counted)
+    """
+
+    out = subprocess.check_output( [sys.executable, '-c', RSS_SCRIPT, filename] )
+
+    # ru_maxrss is in kilobytes on Linux, bytes on OS X
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return int(out.split()[-1]) / float(scale)
+
+
+
+if __name__ == '__main__':
+    main()
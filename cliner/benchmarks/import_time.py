@@ -0,0 +1,87 @@
+######################################################################
+#  CliNER - benchmarks/import_time.py                                #
+#                                                                    #
+#  Purpose: Time how long it takes to import CliNER's modules, each  #
+#               in a fresh interpreter.                              #
+######################################################################
+
+
+import os
+import sys
+import argparse
+import subprocess
+
+
+cliner_dir = os.path.join(os.environ['CLINER_DIR'], 'cliner')
+
+# Modules behind each cliner command
+default_modules = [ 'notes.note'                          ,
+                    'evaluate'                            ,
+                    'format'                              ,
+                    'features_dir.read_config'            ,
+                    'features_dir.sentence_features'      ,
+                    'features_dir.umls_dir.interface_umls',
+                    'model'                               ]
+
+# Run in the child interpreter: import one module, print elapsed seconds
+timer = ( "import sys, time; sys.path.insert(0, %r); "
+          "t = time.time(); import %s; "
+          "sys.stdout.write('%%f' %% (time.time() - t))" )
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m",
+        dest = "modules",
+        help = "Comma separated modules to import",
+        default = ','.join(default_modules)
+    )
+
+    parser.add_argument("-n",
+        dest = "repeat",
+        help = "Number of fresh imports per module",
+        type = int,
+        default = 5
+    )
+
+    args = parser.parse_args()
+
+    print '%-40s %10s %10s' % ('module', 'min (s)', 'median (s)')
+    for module in args.modules.split(','):
+        times = import_times(module, args.repeat)
+        if times is None:
+            print '%-40s %10s %10s' % (module, 'failed', '')
+        else:
+            times.sort()
+            print '%-40s %10.3f %10.3f' % (module, times[0], times[len(times)//2])
+
+
+
+def import_times(module, repeat):
+
+    """
+    import_times()
+
+    @param module. Name of the module to import
+    @param repeat. Number of fresh interpreters to time it in
+    @return        A list of seconds (None if the import failed)
+    """
+
+    times = []
+    for _ in range(repeat):
+        cmd = [ sys.executable, '-c', timer % (cliner_dir, module) ]
+        child = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        out,_ = child.communicate()
+        if child.returncode != 0:
+            return None
+        times.append( float(out.split()[-1]) )
+    return times
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+######################################################################
+#  CliNER - benchmarks/umls_backends.py                              #
+#                                                                    #
+#  Purpose: Compare UMLS lookup speed of the sqlite backend against  #
+#               the mmap'ed trie lexicon.                            #
+######################################################################
+
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append( os.path.join(os.environ['CLINER_DIR'], 'cliner') )
+sys.path.append( os.path.join(os.environ['CLINER_DIR'], 'cliner/features_dir') )
+
+from umls_dir import interface_umls
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n",
+        dest = "lookups",
+        help = "Number of lookups per backend",
+        type = int,
+        default = 100000
+    )
+
+    parser.add_argument("-m",
+        dest = "miss_rate",
+        help = "Fraction of lookups for strings not in UMLS",
+        type = float,
+        default = 0.5
+    )
+
+    args = parser.parse_args()
+
+    strings = sample_strings(args.lookups, args.miss_rate)
+
+    lexicon  = interface_umls.resources.get('umls_lexicon')
+    backends = [ ('sqlite', interface_umls.sql_lookup),
+                 ('trie'  , lexicon.lookup          ) ]
+
+    print '%-8s %12s %12s %14s' % ('backend', 'sty (us)', 'cui (us)', 'lookups/sec')
+    for name,lookup in backends:
+        sty = time_lookups(lookup, 'STYS', strings)
+        cui = time_lookups(lookup, 'CUIS', strings)
+        print '%-8s %12.2f %12.2f %14d' % (name, 1e6*sty, 1e6*cui, 2/(sty+cui))
+
+
+
+def sample_strings(n, miss_rate):
+
+    """
+    sample_strings()
+
+    @param n.         Number of strings
+    @param miss_rate. Fraction of them that are not UMLS strings
+    @return           A shuffled list of lookup strings
+    """
+
+    c = interface_umls.resources.get('umls_db')
+    c.execute( "SELECT STR FROM UMLS_LOOKUP ORDER BY random() LIMIT ? ;", (n,) )
+    hits = [ row[0] for row in c.fetchall() ]
+
+    strings = []
+    for i in range(n):
+        s = hits[i % len(hits)]
+        if random.random() < miss_rate:
+            s = s + ' xyzzy'
+        strings.append(s)
+    return strings
+
+
+
+def time_lookups(lookup, column, strings):
+
+    """
+    time_lookups()
+
+    @param lookup.  A backend's lookup(column, string) function
+    @param column.  'STYS' or 'CUIS'
+    @param strings. Strings to look up
+    @return         Mean seconds per lookup
+    """
+
+    start = time.time()
+    for s in strings:
+        lookup(column, s)
+    return (time.time() - start) / len(strings)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -12,19 +12,54 @@ __date__   = 'Oct. 5, 2014'
 
 
 
+import time
+
+# Measure from before the heavy imports
+start_time = time.time()
+
 import click
 import os
 import sys
-import subprocess
-import glob
 
-sys.path.append( os.environ['CLINER_DIR'] + "/cliner/notes" )
+sys.path.append( os.path.join(os.environ['CLINER_DIR'], "cliner") )
+
+from notes.note import Note
+
+
+# Global command line settings
+settings = { 'profile_startup' : False }
 
-from note import Note
 
 @click.group()
-def cliner():
-    pass
+@click.option('--profile-startup', is_flag=True,
+              help='Report how long startup (imports) took')
+def cliner(profile_startup):
+    settings['profile_startup'] = profile_startup
+
+
+
+def load(module_name):
+
+    """
+    load()
+
+    Purpose: Import one of the CliNER scripts (train, predict, ...) so it
+             can run in this process, reporting startup time if asked
+
+    @param module_name. Name of the script module
+    @return             The module
+    """
+
+    before = time.time()
+    module = __import__(module_name)
+    after  = time.time()
+
+    if settings['profile_startup']:
+        print >>sys.stderr, ('startup: %.3fs (cli: %.3fs, %s: %.3fs)'
+                             % (after - start_time, before - start_time,
+                                module_name, after - before))
+
+    return module
 
 
 supported_formats_help = "Data format ( " + ' | '.join(Note.supportedFormats()) + " )"
@@ -39,8 +74,16 @@ supported_formats_help = "Data format ( " + ' | '.join(Note.supportedFormats())
               default=False)
 @click.option('--crf/--no-crf'  , help='Flag that enables crfsuite'   ,
               default=True)
+@click.option('--vec/--no-vec'  , help='Flag that vectorizes crfsuite features',
+              default=True)
+@click.option('-j', '--jobs'    , help='Processes for feature extraction',
+              type=int)
+@click.option('--stream/--no-stream', help='Flag that streams notes from disk',
+              default=False)
+@click.option('--hash'          , help='Number of hashed feature columns',
+              type=int)
 @click.argument('input')
-def train(annotations, model, format, grid, crf, input):
+def train(annotations, model, format, grid, crf, vec, jobs, stream, hash, input):
 
     # training data needs concept file annotations
     if not annotations:
@@ -48,31 +91,31 @@ def train(annotations, model, format, grid, crf, input):
         print >>sys.stderr,  ''
         exit(1)
 
-    # Base directory
-    BASE_DIR = os.environ.get('CLINER_DIR')
-    if not BASE_DIR:
-        raise Exception('Environment variable CLINER_DIR must be defined')
-
-    # Executable
-    runable = os.path.join(BASE_DIR, 'cliner/train.py')
-
-    # Build command
-    cmd = ['python', runable, '-t', input]
+    # Build arguments for train.py
+    args = ['-t', input]
 
     # Arguments
     if annotations:
-        cmd += ['-c', annotations]
+        args += ['-c', annotations]
     if model:
-        cmd += ['-m',       model]
+        args += ['-m',       model]
     if format:
-        cmd += ['-f',      format]
+        args += ['-f',      format]
     if grid:
-        cmd += ['-g']
+        args += ['-g']
     if not crf:
-        cmd += ['-no-crf']
+        args += ['-no-crf']
+    if not vec:
+        args += ['-no-vec']
+    if jobs:
+        args += ['-j', str(jobs)]
+    if stream:
+        args += ['-stream']
+    if hash:
+        args += ['-hash', str(hash)]
 
-    # Execute train.py
-    subprocess.call(cmd)
+    # Run train.py in this process
+    load('train').main(args)
 
 
 
@@ -82,30 +125,70 @@ def train(annotations, model, format, grid, crf, input):
 @click.option('--out'   , help='The directory to write the output')
 @click.option('--model' , help='Model used to predict on files'   )
 @click.option('--format', help=supported_formats_help             )
-@click.argument('input')
-def predict(model, out, format, input):
+@click.option('--batch' , help='Number of notes classified together',
+              type=int)
+@click.option('--workers', help='Number of worker processes'      ,
+              type=int)
+@click.option('--stream/--no-stream', help='JSON lines on stdin/stdout',
+              default=False)
+@click.option('--latency', help='Max ms a streamed note waits to batch',
+              type=float)
+@click.argument('input', required=False)
+def predict(model, out, format, batch, workers, stream, latency, input):
+
+    # Build arguments for predict.py
+    args = []
+
+    # Input files (or a stream of notes on stdin)
+    if stream:
+        args += ['-stream']
+    elif input:
+        args += ['-i', input]
+    if latency:
+        args += ['-latency', str(latency)]
+
+    # Optional arguments
+    if out:
+        args += ['-o',    out]
+    if model:
+        args += ['-m',  model]
+    if format:
+        args += ['-f', format]
+    if batch:
+        args += ['-b', str(batch)]
+    if workers:
+        args += ['-w', str(workers)]
+
+    # Run predict.py in this process
+    load('predict').main(args)
+
 
-    # Base directory
-    BASE_DIR = os.environ.get('CLINER_DIR')
-    if not BASE_DIR:
-        raise Exception('Environment variable CLINER_DIR must be defined')
 
-    # Executable
-    runable = os.path.join(BASE_DIR,'cliner/predict.py')
 
-    # Build command
-    cmd = ['python', runable, '-i', input]
+
+# Serve
+@cliner.command()
+@click.option('--model' , help='Model used to predict on notes'   )
+@click.option('--format', help=supported_formats_help             )
+@click.option('--host'  , help='Interface to listen on'           )
+@click.option('--port'  , help='Port to listen on', type=int      )
+def serve(model, format, host, port):
+
+    # Build arguments for serve.py
+    args = []
 
     # Optional arguments
-    if out:
-        cmd += ['-o',    out]
     if model:
-        cmd += ['-m',  model]
+        args += ['-m',    model]
     if format:
-        cmd += ['-f', format]
+        args += ['-f',   format]
+    if host:
+        args += ['-host',  host]
+    if port:
+        args += ['-p', str(port)]
 
-    # Execute train.py
-    subprocess.call(cmd)
+    # Run serve.py in this process
+    load('serve').main(args)
 
 
 
@@ -120,29 +203,21 @@ def predict(model, out, format, input):
 @click.argument('input')
 def evaluate(predictions, gold, out, format, input):
 
-    # Base directory
-    BASE_DIR = os.environ.get('CLINER_DIR')
-    if not BASE_DIR:
-        raise Exception('Environment variable CLINER_DIR must be defined')
-
-    # Executable
-    runable = os.path.join(BASE_DIR,'cliner/evaluate.py')
-
-    # Build command
-    cmd = ['python', runable, '-t', input]
+    # Build arguments for evaluate.py
+    args = ['-t', input]
 
     # Optional arguments
     if predictions:
-        cmd += ['-c', predictions]
+        args += ['-c', predictions]
     if gold:
-        cmd += ['-r',        gold]
+        args += ['-r',        gold]
     if out:
-        cmd += ['-o',         out]
+        args += ['-o',         out]
     if format:
-        cmd += ['-f',      format]
+        args += ['-f',      format]
 
-    # Execute train.py
-    subprocess.call(cmd)
+    # Run evaluate.py in this process
+    load('evaluate').main(args)
 
 
 
@@ -156,27 +231,19 @@ def evaluate(predictions, gold, out, format, input):
 @click.argument('input')
 def format(annotations, format, out, input):
 
-    # Base directory
-    BASE_DIR = os.environ.get('CLINER_DIR')
-    if not BASE_DIR:
-        raise Exception('Environment variable CLINER_DIR must be defined')
-
-    # Executable
-    runable = os.path.join(BASE_DIR,'cliner/format.py')
-
-    # Build command
-    cmd = ['python', runable, "-t", input]
+    # Build arguments for format.py
+    args = ['-t', input]
 
     # Optional arguments
     if annotations:
-        cmd += ['-a', annotations]
+        args += ['-a', annotations]
     if out:
-        cmd += ['-o',         out]
+        args += ['-o',         out]
     if format:
-        cmd += ['-f',      format]
+        args += ['-f',      format]
 
-    # Execute train.py
-    subprocess.call(cmd)
+    # Run format.py in this process
+    load('format').main(args)
 
 
 
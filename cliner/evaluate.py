@@ -285,7 +285,7 @@ def generateResultsForExactSpans(truePositive, falseNegative, falsePositive):
     return {"Recall":(recall * 100), "Precision":(precision * 100), "F Score":(fScore * 100)}
 
 
-def main():
+def main(argv=None):
 
     parser = argparse.ArgumentParser()
 
@@ -320,7 +320,7 @@ def main():
     )
 
     # Parse command line arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     format = args.format
 
 
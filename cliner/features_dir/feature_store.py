@@ -0,0 +1,64 @@
+######################################################################
+#  CliNER - feature_store.py                                         #
+#                                                                    #
+#  Purpose: Append-only, on-disk store of extracted features, so     #
+#               training does not need every feature dict in RAM     #
+######################################################################
+
+
+import os
+import tempfile
+import cPickle as pickle
+
+
+tmp_dir = os.path.join(os.environ["CLINER_DIR"], "cliner/tmp_files_dir")
+
+
+class FeatureStore:
+
+    """
+    A temp file of pickled records that can be appended to and then
+    streamed back (any number of times) in insertion order.
+    """
+
+    def __init__(self, suffix='feature_store'):
+        fd,self.filename = tempfile.mkstemp(dir=tmp_dir, suffix=suffix)
+        self.f = os.fdopen(fd, 'wb')
+        self.count = 0
+
+
+    def __len__(self):
+        return self.count
+
+
+    def append(self, record):
+        pickle.dump(record, self.f, -1)
+        self.count += 1
+
+
+    def records(self):
+        """ Stream every record back, in the order they were appended """
+        self.f.flush()
+        with open(self.filename, 'rb') as f:
+            for _ in xrange(self.count):
+                yield pickle.load(f)
+
+
+    def chunks(self, size):
+        """ Stream records back as lists of (at most) size records """
+        chunk = []
+        for record in self.records():
+            chunk.append(record)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+    def close(self):
+        """ Delete the backing file """
+        if not self.f.closed:
+            self.f.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
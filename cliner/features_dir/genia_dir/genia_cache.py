@@ -1,30 +1,185 @@
-import cPickle as pickle
+######################################################################
+#  CliNER - genia_cache.py                                           #
+#                                                                    #
+#  Purpose: Persistent cache of GENIA tagger output, sharded over    #
+#               sqlite files and keyed by a hash of the sentence     #
+######################################################################
+
+
 import os
-import sys
+import hashlib
+import sqlite3
+import threading
+
+from features_dir import resources
+from features_dir.read_config import enabled_modules
 
-sys.path.append((os.environ["CLINER_DIR"] + "/cliner/features_dir"))
 
-from utilities import load_pickled_obj
+# Number of shard files (each is locked independently by writers)
+N_SHARDS = 16
+
+# Total size the shards may grow to (GENIA_CACHE_MB in config.txt overrides it)
+DEFAULT_MB = 1024
+
+# Fraction of a full shard's entries evicted at once (oldest first)
+EVICT_FRACTION = 0.25
 
 
 class GeniaCache:
-    def __init__(self):
-        try:
-            prefix = os.path.dirname(__file__)
-            self.filename = os.path.join( prefix, 'genia_cache' )
-            self.cache = load_pickled_obj(self.filename)
-        except IOError:
-            self.cache = {}
+
+    """
+    Maps sentences to their tagger output lines.
+
+        - only the entries that are asked for are read from disk
+        - new entries are appended; when a shard outgrows its share of the
+          size limit, its oldest entries are evicted (freed pages are reused)
+        - every process opens its own connections (sqlite WAL mode), so
+          parallel runs can share one cache directory safely
+
+    GENIA_CACHE_DIR in config.txt sets the directory
+    (default: $CLINER_DIR/caches/genia).
+    """
+
+    def __init__(self, directory=None, max_mb=None):
+
+        config = enabled_modules()
+        if directory is None:
+            directory = config.get('GENIA_CACHE_DIR') or \
+                        os.path.join(os.environ['CLINER_DIR'], 'caches', 'genia')
+        if max_mb is None:
+            max_mb = float( config.get('GENIA_CACHE_MB') or DEFAULT_MB )
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process created it first
+                pass
+
+        self.directory   = directory
+        self.shard_bytes = int( max_mb * 2**20 / N_SHARDS )
+        self.lock        = threading.RLock()
+
+        # Connections of the process that opened them
+        self.pid   = None
+        self.conns = {}
+
+
+    def connect(self, shard):
+        if self.pid != os.getpid():
+            self.conns = {}
+            self.pid = os.getpid()
+        if shard not in self.conns:
+            filename = os.path.join(self.directory, 'shard-%02d.db' % shard)
+            conn = sqlite3.connect( filename, timeout=60, check_same_thread=False )
+            conn.text_factory = str
+            conn.execute( "PRAGMA journal_mode = WAL ;" )
+            conn.execute( "CREATE TABLE IF NOT EXISTS CACHE( KEY TEXT PRIMARY KEY, VALUE ) ;" )
+            conn.commit()
+            self.conns[shard] = conn
+        return self.conns[shard]
+
+
+    def get_many(self, sentences):
+
+        """
+        get_many()
+
+        @param sentences. An iterable of sentences
+        @return           A dictionary of the cached ones: sentence -> tag lines
+        """
+
+        found = {}
+        with self.lock:
+            for shard,keys in group(sentences).items():
+                conn = self.connect(shard)
+                for key,sentence in keys.items():
+                    row = conn.execute( "SELECT VALUE FROM CACHE WHERE KEY = ? ;", (key,) ).fetchone()
+                    if row:
+                        found[sentence] = unpack(row[0])
+        return found
+
+
+    def add_many(self, tagged):
+
+        """
+        add_many()
+
+        @param tagged. A dictionary: sentence -> tag lines
+        """
+
+        with self.lock:
+            for shard,keys in group(tagged).items():
+                conn = self.connect(shard)
+                rows = [ (key, pack(tagged[sentence])) for key,sentence in keys.items() ]
+                with conn:
+                    conn.executemany( "INSERT OR REPLACE INTO CACHE( KEY, VALUE ) values( ?, ? )", rows )
+                self.evict(conn)
+
+
+    def evict(self, conn):
+        """ Drop the oldest entries of a shard that has outgrown its share """
+        page_size = conn.execute( "PRAGMA page_size ;" ).fetchone()[0]
+        pages     = conn.execute( "PRAGMA page_count ;" ).fetchone()[0]
+        free      = conn.execute( "PRAGMA freelist_count ;" ).fetchone()[0]
+        if (pages - free) * page_size <= self.shard_bytes:
+            return
+
+        count = conn.execute( "SELECT count(*) FROM CACHE ;" ).fetchone()[0]
+        with conn:
+            conn.execute( "DELETE FROM CACHE WHERE rowid IN ( SELECT rowid FROM CACHE ORDER BY rowid LIMIT ? ) ;",
+                          (int(count * EVICT_FRACTION) + 1,) )
+
 
     def has_key(self, key):
-        return self.cache.has_key( str(key) )
+        return bool( self.get_many([key]) )
 
     def add_map(self, key, value):
-        self.cache[ str(key) ] = value
+        self.add_many( {key:value} )
 
     def get_map(self, key):
-        return self.cache[ str(key) ]
+        return self.get_many([key])[key]
+
+
+
+def content_key(sentence):
+
+    """
+    content_key()
+
+    Purpose: Hash of a sentence (the store never holds the text itself)
+
+    >>> content_key('the patient') == content_key(u'the patient')
+    True
+    >>> len(content_key('the patient'))
+    40
+    """
+
+    if isinstance(sentence, unicode):
+        sentence = sentence.encode('utf-8')
+    return hashlib.sha1(sentence).hexdigest()
+
+
+
+def group(sentences):
+    """ {shard: {key: sentence}} for an iterable of sentences """
+    shards = {}
+    for sentence in sentences:
+        key = content_key(sentence)
+        shards.setdefault( int(key[:4],16) % N_SHARDS, {} )[key] = sentence
+    return shards
+
+
+
+def pack(lines):
+    """ Tagger output lines -> stored value """
+    return '\n'.join(lines)
+
+def unpack(value):
+    """ Stored value -> tagger output lines """
+    return value.split('\n') if value else []
+
 
-    def __del__(self):
-        pickle.dump( self.cache, open( self.filename, "wb" ) )
 
+# One cache per process, shared by every call to interface_genia.genia()
+resources.register('genia_cache', GeniaCache)
@@ -15,19 +15,49 @@ from features_dir import utilities
 class GeniaFeatures:
 
 
-    def __init__(self, tagger, data):
+    def __init__(self, tagger, data=None):
 
         """
         Constructor.
 
-        @param data. A list of split sentences
+        @param tagger. A path to the executable geniatagger
+        @param data.   A list of split sentences to prefetch (optional)
+        """
+
+        self.tagger = tagger
+
+        # GENIA output of each sentence looked up so far (keyed by text)
+        self.GENIA_features = {}
+
+        if data:
+            self.prefetch(data)
+
+
+
+    def prefetch(self, sentences):
+
+        """
+        prefetch()
+
+        Purpose: Tag every prose sentence not looked up yet, in one batch
+
+        @param sentences. A list of split sentences
         """
 
         # Filter out nonprose sentences
-        prose = [ sent  for  sent  in  data  if  utilities.is_prose_sentence(sent) ]
+        prose = [ sent  for  sent  in  sentences  if  utilities.is_prose_sentence(sent) ]
+
+        self.tag(prose)
+
+
 
-        # Process prose sentences with GENIA tagger
-        self.GENIA_features = iter(interface_genia.genia(tagger, prose))
+    def tag(self, sentences):
+        """ Look up (or run the tagger on) sentences missing from the map """
+        todo = [ s for s in sentences if ' '.join(s) not in self.GENIA_features ]
+        if todo:
+            # Process sentences with GENIA tagger
+            for sent,feats in zip(todo, interface_genia.genia(self.tagger, todo)):
+                self.GENIA_features[' '.join(sent)] = feats
 
 
 
@@ -41,8 +71,8 @@ class GeniaFeatures:
         @param is_prose. Mechanism for skipping nonprose (for alignment)
         @return          list of dictionaries (of features)
 
-        Note: All data is tagged upon instantiation of GeniaFeatures object.
-              This function MUST take each line of the file (in order) as input
+        Note: Sentences may be looked up in any order. Ones that were not
+              prefetched are tagged on demand.
         """
 
         # Return value is a list of dictionaries (of features)
@@ -54,7 +84,8 @@ class GeniaFeatures:
 
 
         # Get the GENIA features of the current sentence
-        genia_feats = next( self.GENIA_features )
+        self.tag( [sentence] )
+        genia_feats = self.GENIA_features[ ' '.join(sentence) ]
 
 
         # Feature: Current word's GENIA features
@@ -16,12 +16,208 @@ __date__   = 'Jan. 27, 2014'
 
 import os
 import sys
-import tempfile
+import threading
+import subprocess
+import multiprocessing
+from multiprocessing import util
+
+import genia_cache          # registers the genia_cache resource
+from features_dir import resources
+from features_dir.read_config import enabled_modules
+
+
+
+class GeniaTagger:
+
+    """
+    One long-lived geniatagger process, fed over stdin/stdout pipes (its
+    models are only loaded once, when the process starts)
+    """
+
+    def __init__(self, geniatagger):
+        self.geniatagger = geniatagger
+        self.devnull = open(os.devnull, 'w')
+        self.start()
+
+
+    def start(self):
+        genia_dir = os.path.dirname(self.geniatagger)
+        self.proc = subprocess.Popen(['./geniatagger', '-nt'], cwd=genia_dir,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=self.devnull)
+
+
+    def restart(self):
+        """ Replace a dead (or broken) tagger process with a new one """
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except IOError:
+                pass
+        self.start()
+
+
+    def tag(self, sentences):
+
+        """
+        tag()
+
+        Purpose: Stream sentences through the tagger. If the tagger has died
+                 (broken pipe or end of output), it is restarted once and the
+                 batch is tagged again.
+
+        @param sentences. A list of sentences (strings of space-separated words)
+        @return           A list of tagger output lines for each sentence
+        """
+
+        try:
+            return self.tag_once(sentences)
+        except (IOError, RuntimeError):
+            self.restart()
+            return self.tag_once(sentences)
+
+
+    def tag_once(self, sentences):
+
+        # Blank lines produce no output block to read back
+        todo = [ s for s in sentences if s.strip() ]
+
+        # Feed stdin from a thread, so a full stdout pipe cannot deadlock us
+        # (the thread keeps writing to this process even after a restart)
+        writer = threading.Thread(target=self.write, args=(self.proc, todo))
+        writer.daemon = True
+        writer.start()
+
+        tagged = {}
+        for sent in todo:
+            linetags = []
+            while True:
+                tag = self.proc.stdout.readline()
+                if not tag:
+                    raise RuntimeError('GENIA tagger exited unexpectedly')
+                if tag.split():               # Part of line
+                    linetags.append(tag.rstrip('\n'))
+                else:                         # End  of line
+                    break
+            tagged[sent] = linetags
+
+        writer.join()
+        return [ tagged.get(s, []) for s in sentences ]
+
+
+    def write(self, proc, sentences):
+        try:
+            for sent in sentences:
+                proc.stdin.write(sent + '\n')
+                proc.stdin.flush()
+        except IOError:
+            # Tagger died: the reader reports it
+            pass
+
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+        self.devnull.close()
+
+
+
+class GeniaPool:
+
+    """
+    N persistent GENIA taggers; a batch of sentences is split into
+    contiguous shards that are tagged in parallel
+    """
+
+    def __init__(self, geniatagger, n_procs):
+        self.geniatagger = geniatagger
+        self.n_procs     = max(1, n_procs)
+        self.lock        = threading.Lock()
+        self.pid         = None
+        self.taggers     = []
+
+        # Shut the taggers down at exit (also in multiprocessing workers)
+        util.Finalize(self, self.close, exitpriority=10)
+
+
+    def start(self):
+        # Processes inherited over fork belong to the parent
+        if self.pid != os.getpid():
+            self.taggers = [ GeniaTagger(self.geniatagger) for _ in range(self.n_procs) ]
+            self.pid = os.getpid()
+
+
+    def tag(self, sentences):
+
+        """
+        tag()
+
+        @param sentences. A list of sentences (strings of space-separated words)
+        @return           A list of tagger output lines for each sentence
+        """
+
+        with self.lock:
+            self.start()
+
+            size   = (len(sentences) + self.n_procs - 1) // self.n_procs or 1
+            shards = [ sentences[i:i+size] for i in range(0, len(sentences), size) ]
+            results = [ None for _ in shards ]
+
+            def run(i):
+                try:
+                    results[i] = self.taggers[i].tag(shards[i])
+                except Exception, e:
+                    results[i] = e
+
+            threads = [ threading.Thread(target=run, args=(i,)) for i in range(len(shards)) ]
+            for t in threads: t.start()
+            for t in threads: t.join()
+
+            tagged = []
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+                tagged += result
+            return tagged
+
+
+    def close(self):
+        if self.pid == os.getpid():
+            for tagger in self.taggers:
+                tagger.close()
+            self.taggers = []
+            self.pid = None
+
+
+
+def get_pool(geniatagger):
+
+    """
+    get_pool()
+
+    @param geniatagger. A path to the executable geniatagger
+    @return             The shared GeniaPool for that tagger (started on first use)
+
+    GENIA_WORKERS in config.txt sets the number of tagger processes
+    (default: one per core, at most 4).
+    """
+
+    def create():
+        n = enabled_modules().get('GENIA_WORKERS')
+        n = int(n) if n else min(4, multiprocessing.cpu_count())
+        return GeniaPool(geniatagger, n)
+
+    name = 'genia_pool:' + geniatagger
+    resources.register(name, create)
+    return resources.get(name)
 
-from commands import getstatusoutput
-from genia_cache import GeniaCache
 
-tmp_dir = os.path.join(os.environ["CLINER_DIR"], "cliner/tmp_files_dir")
 
 def genia(geniatagger, data):
 
@@ -35,48 +231,29 @@ def genia(geniatagger, data):
     @return              A list of dcitionaries of the genia tagger's output.
     '''
 
-    # Lookup cache
-    cache = GeniaCache()
+    # Lookup cache (only this note's lines are read from it)
+    cache = resources.get('genia_cache')
+    sents = [ ' '.join(line) for line in data ]
+    found = cache.get_many(sents)
 
-    # Get uncached lines
+    # Get uncached lines (each distinct line is only tagged once)
     uncached = []
-    for line in data:
-        sent = ' '.join(line)
-        if not cache.has_key(sent):
+    for sent in sents:
+        if sent not in found:
+            found[sent] = None
             uncached.append(sent)
 
 
     if uncached:
-        # write list to file and then feed it to GENIA
-        genia_dir = os.path.dirname(geniatagger)
-
-        out = tempfile.mkstemp(dir=tmp_dir, suffix="genia_temp")[1]
-
-        with open(out, 'w') as f:
-            for line in uncached: f.write(line + '\n')
-
-        # Run genia tagger
+        # Stream them through the persistent tagger processes
         print '\t\tRunning  GENIA tagger'
-        genia_dir = os.path.dirname(geniatagger)
-        stream = getstatusoutput('cd %s ; ./geniatagger -nt %s' %(genia_dir,out))
+        tagged = get_pool(geniatagger).tag(uncached)
         print '\t\tFinished GENIA tagger'
 
-        # Organize tagger output
-        linetags = []
-        tagged = []
-        for tag in stream[1].split('\n')[4:]:
-            if tag.split():               # Part of line
-                linetags.append(tag)
-            else:                         # End  of line
-                tagged.append(linetags)
-                linetags = []
-
         # Add tagger output to cache
-        for line,tags in zip(uncached,tagged):
-            cache.add_map(line,tags)
-
-        # Remove temp file
-        os.remove(out)
+        new = dict( zip(uncached,tagged) )
+        cache.add_many(new)
+        found.update(new)
 
 
     # Extract features
@@ -85,8 +262,8 @@ def genia(geniatagger, data):
     for line in data:
         line = ' '.join(line)
 
-        # Get tagged output from cache
-        tags = cache.get_map(line)
+        # Get tagged output
+        tags = found[line]
 
         for tag in tags:
             tag = tag.split()
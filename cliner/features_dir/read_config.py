@@ -11,6 +11,8 @@
 
 import os
 
+from features_dir import resources
+
 
 def enabled_modules():
     """
@@ -18,17 +20,31 @@ def enabled_modules():
 
     @return a dictionary of {name, resource} pairs.
 
-    ex. {'UMLS': None, 'GENIA': 'genia/geniatagger-3.0.1/geniatagger'}
+    ex. {'UMLS': None, 'GENIA': 'genia/geniatagger-3.0.1/geniatagger',
+         'UMLS_BACKEND': 'sqlite', 'UMLS_CACHE_SIZE': '100000'}
 
     >>> enabled_modules() is not None
     True
     """
+    # Config file is only read once
+    return resources.get('config')
+
+
+
+def load_config():
+    """
+    load_config()
+
+    Purpose: Read config.txt (use enabled_modules() for the shared copy)
+    """
     # Open config file
     filename = os.path.join( os.getenv('CLINER_DIR'), 'config.txt' )
     f = open(filename, 'r')
 
     specs = {}
     module_list = [ 'GENIA', 'UMLS' ]
+    setting_list = [ 'UMLS_BACKEND', 'UMLS_CACHE_SIZE', 'GENIA_WORKERS',
+                     'GENIA_CACHE_DIR', 'GENIA_CACHE_MB', 'WORD_CACHE_SIZE' ]
 
 
     for line in f.readlines():
@@ -42,9 +58,12 @@ def enabled_modules():
                 else:
                     specs[words[0]] = words[1]
 
+            # Settings
+            if words[0] in setting_list:
+                specs[words[0]] = words[1]
+
     return specs
 
 
 
-# Read from config file when module is imported
-print enabled_modules()
+resources.register('config', load_config)
@@ -0,0 +1,67 @@
+######################################################################
+#  CliNER - resources.py                                             #
+#                                                                    #
+#  Purpose: Registry of heavy shared resources (POS tagger, UMLS     #
+#               database, concept trie, config) that are only        #
+#               created the first time they are used                 #
+######################################################################
+
+
+import threading
+
+
+# name -> function that creates the resource
+factories = {}
+
+# name -> created resource
+loaded = {}
+
+lock = threading.RLock()
+
+
+
+def register(name, factory):
+
+    """
+    register()
+
+    Purpose: Declare how to build a resource (nothing is built yet)
+
+    @param name.    Name used to get() the resource
+    @param factory. A function of no arguments returning the resource
+    """
+
+    with lock:
+        factories.setdefault(name, factory)
+
+
+
+def get(name):
+
+    """
+    get()
+
+    Purpose: Return a resource, creating it on first use
+
+    >>> register('answer', lambda: 42)
+    >>> get('answer')
+    42
+    >>> is_loaded('answer')
+    True
+    """
+
+    try:
+        return loaded[name]
+    except KeyError:
+        pass
+
+    with lock:
+        if name not in loaded:
+            loaded[name] = factories[name]()
+        return loaded[name]
+
+
+
+def is_loaded(name):
+    """ Has the resource already been created? """
+    return name in loaded
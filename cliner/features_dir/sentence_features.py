@@ -10,7 +10,7 @@
 __author__ = 'Willie Boag'
 __date__   = 'Apr. 27, 2014'
 
-from utilities import load_pos_tagger
+from features_dir import resources
 
 from wordshape import getWordShapes
 
@@ -27,8 +27,6 @@ if enabled['UMLS']:
 
 from word_features import WordFeatures
 
-nltk_tagger = load_pos_tagger()
-
 class SentenceFeatures:
 
 
@@ -46,7 +44,8 @@ class SentenceFeatures:
         self.feat_word = WordFeatures()
 
         # Only run GENIA tagger if module is available
-        if data and enabled['GENIA']:
+        #   (data is tagged in one batch; other sentences on demand)
+        if enabled['GENIA']:
             tagger = enabled['GENIA']
             self.feat_genia = GeniaFeatures(tagger,data)
 
@@ -56,6 +55,10 @@ class SentenceFeatures:
         if enabled['UMLS']:
             self.feat_umls = UMLSFeatures()
 
+            # Resolve every word of the note in one round-trip
+            if data:
+                self.feat_umls.prefetch(data)
+
 
         self.enabled_IOB_nonprose_sentence_features = []
         #self.enabled_IOB_nonprose_sentence_features.append('pos')
@@ -113,7 +116,7 @@ class SentenceFeatures:
 
         # Only POS tag once
         if 'pos' in self.enabled_IOB_prose_sentence_features:
-            pos_tagged = nltk_tagger.tag(sentence)
+            pos_tagged = resources.get('pos_tagger').tag(sentence)
 
         # Allow for particular features to be enabled
         for feature in self.enabled_IOB_prose_sentence_features:
@@ -273,7 +276,7 @@ class SentenceFeatures:
         #return features_list
 
         if 'pos' in self.enabled_IOB_nonprose_sentence_features:
-            pos_tagged = nltk_tagger.tag(sentence)
+            pos_tagged = resources.get('pos_tagger').tag(sentence)
 
         # Allow for particular features to be enabled
         for feature in self.enabled_IOB_nonprose_sentence_features:
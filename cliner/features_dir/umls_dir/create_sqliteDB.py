@@ -4,8 +4,38 @@ import os
 import sys
 import os
 
+
+# Rows inserted (and committed) per executemany() call
+CHUNK_SIZE = 100000
+
+
+# (table, source file, columns) in load order
+TABLES = [ ('MRSTY', 'MRSTY', ('CUI', 'TUI', 'STY', 'EMPTY')),
+           ('MRCON', 'MRCON', ('CUI', 'LAT', 'TS', 'LUI', 'STT', 'SUI', 'STR', 'LRL', 'EMPTY')),
+           ('MRREL', 'MRREL', ('CUI1', 'REL', 'CUI2', 'RELA', 'SAB', 'SL', 'MG', 'EMPTY')) ]
+
+
+# Indices are only built once every table has been loaded
+INDICES = [ "CREATE INDEX IF NOT EXISTS mrsty_cui_map ON MRSTY(CUI)",
+            "CREATE INDEX IF NOT EXISTS mrcon_str_map ON MRCON(STR)",
+            "CREATE INDEX IF NOT EXISTS mrcon_cui_map ON MRCON(CUI)",
+            "CREATE INDEX IF NOT EXISTS mrrel_cui2_map ON MRREL( CUI2 )",
+            "CREATE INDEX IF NOT EXISTS mrrel_cui1_map on MRREL( CUI1 )",
+            "CREATE INDEX IF NOT EXISTS mrrel_rel_map on MRREL( REL )" ]
+
+
 def create_db():
 
+    """
+    create_db()
+
+    Purpose: Bulk load the UMLS tables into umls.db
+
+    A build that is interrupted resumes from its last committed chunk the
+    next time this is called (BUILD_PROGRESS only exists until it finishes).
+    Chunks are transactions, so an interrupted one leaves nothing behind.
+    """
+
     print "\ncreating umls.db"
     #connect to the .db file we are creating.
     db_path = os.path.join(os.environ['CLINER_DIR'],'umls_tables/umls.db')
@@ -13,80 +43,51 @@ def create_db():
     conn.text_factory = str
 
     print "opening files"
-    #load data in files.
-    try:
-        mrsty_path = os.path.join(os.environ['CLINER_DIR'],'umls_tables/MRSTY')
-        MRSTY_TABLE_FILE = open( mrsty_path, "r" )
-    except IOError:
-        print "\nNo file to use for creating MRSTY table\n"
-        conn.close()
-        sys.exit()
-
-    try:
-        mrcon_path = os.path.join(os.environ['CLINER_DIR'],'umls_tables/MRCON')
-        MRCON_TABLE_FILE = open( mrcon_path , "r" )
-    except IOError:
-        print "\nNo file to use for creating MRCON table\n"
-        conn.close()
-        sys.exit()
-
-    try:
-        mrrel_path = os.path.join(os.environ['CLINER_DIR'],'umls_tables/MRREL')
-        MRREL_TABLE_FILE = open( mrrel_path , "r" )
-    except IOError:
-        print "\nNo file to use for creating MRREL table\n"
-        conn.close()
-        sys.exit()
+    #check that every file is available before loading anything.
+    for table,filename,columns in TABLES:
+        path = os.path.join(os.environ['CLINER_DIR'],'umls_tables',filename)
+        if not os.path.isfile( path ):
+            print "\nNo file to use for creating %s table\n" % table
+            conn.close()
+            sys.exit()
 
-    print "creating tables"
     c = conn.cursor()
 
-    #create tables.
-    c.execute( "CREATE TABLE MRCON( CUI, LAT, TS, LUI, STT, SUI, STR, LRL, EMPTY ) ;" )
-    c.execute( "CREATE TABLE MRSTY( CUI, TUI, STY, EMPTY ) ;" )
-    c.execute( "CREATE TABLE MRREL( CUI1, REL, CUI2, RELA, SAB, SL, MG, EMPTY ) ;" )
-
-    print "inserting data into MRSTY table"
-    for line in MRSTY_TABLE_FILE:
-
-        try:
-            c.execute( "INSERT INTO MRSTY( CUI, TUI, STY, EMPTY) values( ?, ?, ?, ?)" , tuple(line[0:-1].split('|')) )
-        except sqlite3.ProgrammingError:
-            continue
+    # Each chunk commits atomically, so a crash mid-chunk rolls back to the
+    # last checkpoint (WAL: no rollback journal copies of the pages written)
+    c.execute( "PRAGMA journal_mode = WAL ;" )
+    c.execute( "PRAGMA synchronous = NORMAL ;" )
 
-    MRSTY_TABLE_FILE.close()
-
-    print "inserting data into MRCON table"
-    for line in MRCON_TABLE_FILE:
+    c.execute( "CREATE TABLE IF NOT EXISTS BUILD_PROGRESS( STAGE PRIMARY KEY, LINES, LAST_ROWID, DONE ) ;" )
+    conn.commit()
 
-        try:
-            c.execute( "INSERT INTO MRCON( CUI, LAT, TS, LUI, STT, SUI, STR, LRL, EMPTY ) values ( ?, ?, ? ,?, ?,?,?,?,?);", tuple(line[0:-1].split('|')) )
-        except sqlite3.ProgrammingError:
-            continue
-    
-    MRCON_TABLE_FILE.close()
+    print "creating tables"
+    for table,filename,columns in TABLES:
+        c.execute( "CREATE TABLE IF NOT EXISTS %s( %s ) ;" % (table, ', '.join(columns)) )
+    conn.commit()
 
-    print "inserting data into MRREL table"
-    for line in MRREL_TABLE_FILE:
-        
-        try:
-            c.execute( "INSERT INTO MRREL(  CUI1, REL, CUI2, RELA, SAB, SL, MG, EMPTY ) values( ?, ?, ?, ?,?, ? ,? ,? )" , tuple(line[0:-1].split('|')) )
-        except sqlite3.ProgrammingError:
-            continue
+    for table,filename,columns in TABLES:
+        path = os.path.join(os.environ['CLINER_DIR'],'umls_tables',filename)
+        load_table( conn, table, path, columns )
 
-    MRREL_TABLE_FILE.close()
+    if not stage_done( c, 'indices' ):
+        print "creating indices"
 
-    print "creating indices"
+        #create indices for faster queries
+        for index in INDICES:
+            c.execute( index )
+        finish_stage( c, 'indices' )
+        conn.commit()
 
-    #create indices for faster queries
-    c.execute( "CREATE INDEX mrsty_cui_map ON MRSTY(CUI)")
-    c.execute( "CREATE INDEX mrcon_str_map ON MRCON(STR)")
-    c.execute( "CREATE INDEX mrcon_cui_map ON MRCON(CUI)")
-    c.execute( "CREATE INDEX mrrel_cui2_map ON MRREL( CUI2 )" )
-    c.execute( "CREATE INDEX mrrel_cui1_map on MRREL( CUI1 ) " )
-    c.execute( "CREATE INDEX mrrel_rel_map on MRREL( REL )" )
+    if not stage_done( c, 'UMLS_LOOKUP' ):
+        print "creating string lookup table"
+        c.execute( "DROP TABLE IF EXISTS UMLS_LOOKUP ;" )
+        create_lookup_table( c )
+        finish_stage( c, 'UMLS_LOOKUP' )
+        conn.commit()
 
     #save changes to .db
+    c.execute( "DROP TABLE BUILD_PROGRESS ;" )
     conn.commit()
 
     print "\nsqlite database created"
@@ -94,6 +95,133 @@ def create_db():
     #close connection
     conn.close()
 
+
+def is_built( db_path ):
+
+    """
+    is_built()
+
+    @param db_path. Path to umls.db
+    @return         False if the database is missing or its build unfinished
+    """
+
+    if not os.path.isfile( db_path ):
+        return False
+
+    conn = sqlite3.connect( db_path )
+    c = conn.cursor()
+    c.execute( "SELECT name FROM sqlite_master WHERE type='table' ;" )
+    tables = set( row[0] for row in c.fetchall() )
+    conn.close()
+
+    return ('MRCON' in tables) and ('BUILD_PROGRESS' not in tables)
+
+
+def load_table( conn, table, path, columns ):
+
+    """
+    load_table()
+
+    Purpose: Stream one '|'-separated UMLS file into its table with
+             executemany(), committing a checkpoint after every chunk
+
+    @param conn.    Connection to umls.db
+    @param table.   Name of the table to fill
+    @param path.    UMLS file to read
+    @param columns. Column names of the table
+    """
+
+    c = conn.cursor()
+
+    if stage_done( c, table ):
+        print "%s table already loaded" % table
+        return
+
+    # Resume after the last committed chunk
+    c.execute( "SELECT LINES, LAST_ROWID FROM BUILD_PROGRESS WHERE STAGE = ? ;", (table,) )
+    row = c.fetchone()
+    lines,last_rowid = row if row else (0, 0)
+    c.execute( "DELETE FROM %s WHERE rowid > ? ;" % table, (last_rowid,) )
+
+    if lines:
+        print "resuming %s table after %d lines" % (table, lines)
+    else:
+        print "inserting data into %s table" % table
+
+    insert = "INSERT INTO %s( %s ) values( %s )" % (table, ', '.join(columns), ', '.join('?'*len(columns)))
+    size   = os.path.getsize( path ) or 1
+
+    with open( path, "r" ) as f:
+        done  = 0
+        n     = lines
+        chunk = []
+        for i,line in enumerate(f):
+            done += len(line)
+            if i < lines: continue
+            n = i + 1
+
+            # Skip malformed lines
+            row = line[0:-1].split('|')
+            if len(row) == len(columns):
+                chunk.append( row )
+
+            if (n - lines) % CHUNK_SIZE == 0:
+                checkpoint( conn, table, insert, chunk, n )
+                chunk = []
+                print "\t%s: %d lines (%.1f%%)" % (table, n, 100.0 * done / size)
+
+        checkpoint( conn, table, insert, chunk, n )
+
+    finish_stage( c, table )
+    conn.commit()
+
+
+def checkpoint( conn, table, insert, rows, lines ):
+    """ Insert a chunk and record how far into the file the build has got """
+    c = conn.cursor()
+    c.executemany( insert, rows )
+    c.execute( "SELECT max(rowid) FROM %s ;" % table )
+    last_rowid = c.fetchone()[0] or 0
+    c.execute( "INSERT OR REPLACE INTO BUILD_PROGRESS( STAGE, LINES, LAST_ROWID, DONE ) values( ?, ?, ?, 0 )",
+               (table, lines, last_rowid) )
+    conn.commit()
+
+
+def stage_done( c, stage ):
+    """ Has this stage of the build already finished? """
+    c.execute( "SELECT DONE FROM BUILD_PROGRESS WHERE STAGE = ? ;", (stage,) )
+    row = c.fetchone()
+    return bool(row and row[0])
+
+
+def finish_stage( c, stage ):
+    """ Mark a stage of the build as finished """
+    c.execute( "INSERT OR REPLACE INTO BUILD_PROGRESS( STAGE, LINES, LAST_ROWID, DONE ) values( ?, 0, 0, 1 )", (stage,) )
+
+
+def create_lookup_table( c ):
+
+    """
+    create_lookup_table()
+
+    Purpose: Precompute string -> (CUIs, semantic types) so that a lookup
+             is one primary key read instead of an index probe plus a join
+
+    @param c. A cursor on a database with MRCON and MRSTY loaded
+    """
+
+    # Values are '|'-separated (the delimiter of the UMLS files themselves)
+    c.execute( "CREATE TABLE UMLS_LOOKUP( STR, CUIS, STYS, PRIMARY KEY(STR) ) WITHOUT ROWID ;" )
+    c.execute( """INSERT INTO UMLS_LOOKUP( STR, CUIS, STYS )
+                  SELECT a.STR, a.CUIS, b.STYS
+                  FROM      ( SELECT STR, group_concat(CUI, '|') AS CUIS
+                              FROM ( SELECT DISTINCT STR, CUI FROM MRCON WHERE STR IS NOT NULL )
+                              GROUP BY STR ) a
+                  LEFT JOIN ( SELECT STR, group_concat(STY, '|') AS STYS
+                              FROM ( SELECT DISTINCT x.STR, y.STY FROM MRCON x, MRSTY y WHERE x.CUI = y.CUI )
+                              GROUP BY STR ) b
+                  ON a.STR = b.STR ;""" )
+
+
 if __name__ == "__main__":
     create_db()
-
@@ -6,12 +6,21 @@
 
 
 import copy
+import fcntl
 import sqlite3
 import create_sqliteDB
 import os
+from contextlib import contextmanager
 
 import create_trie
+import umls_lexicon
 
+from features_dir import resources
+from features_dir.read_config import enabled_modules
+
+
+# Seconds to wait for another process holding umls.db's write lock
+LOCK_TIMEOUT = 3600
 
 
 
@@ -20,19 +29,91 @@ import create_trie
 ############################################
 
 
+@contextmanager
+def build_lock( path ):
+
+    """
+    build_lock()
+
+    Purpose: Hold an exclusive lock on path + '.lock' while one process
+             builds a shared UMLS file. Workers forked together (-j, -w)
+             wait here, then find the file built (check again inside).
+    """
+
+    with open( path + '.lock', 'a' ) as f:
+        fcntl.flock( f, fcntl.LOCK_EX )
+        try:
+            yield
+        finally:
+            fcntl.flock( f, fcntl.LOCK_UN )
+
+
 #connect to UMLS database
 def SQLConnect():
     #try to connect to the sqlite database.
     db_path = os.path.join( os.environ['CLINER_DIR'], "umls_tables/umls.db")
-    if( os.path.isfile( db_path ) ):
+    if( create_sqliteDB.is_built( db_path ) ):
         print "\ndb exists"
     else:
-        # Database does not exit. Make one.
-        print "\ndb doesn't exist"
-        create_sqliteDB.create_db()
+        with build_lock( db_path ):
+            if not create_sqliteDB.is_built( db_path ):
+                # Database does not exit (or its build was interrupted). Make one.
+                print "\ndb doesn't exist"
+                create_sqliteDB.create_db()
+
+    # Long timeout: other processes may be waiting for the table below
+    db = sqlite3.connect( db_path, timeout=LOCK_TIMEOUT )
+    c  = db.cursor()
+
+    # Databases built before the lookup table existed
+    if not has_lookup_table( c ):
+        # Workers started together race here: one takes the write lock and
+        # builds the table, the rest wait for it and find it built
+        db.isolation_level = None
+        c.execute( "BEGIN IMMEDIATE ;" )
+        try:
+            if not has_lookup_table( c ):
+                print "\ncreating string lookup table"
+                create_sqliteDB.create_lookup_table( c )
+            c.execute( "COMMIT ;" )
+        except:
+            c.execute( "ROLLBACK ;" )
+            raise
+        db.isolation_level = ''
+
+    return c
+
+
+def has_lookup_table( c ):
+    c.execute( "SELECT name FROM sqlite_master WHERE type='table' AND name='UMLS_LOOKUP' ;" )
+    return bool( c.fetchall() )
+
 
-    db = sqlite3.connect( db_path )
-    return db.cursor()
+#load (or compile) the mmap'ed UMLS lexicon
+def LexiconConnect():
+    prefix = os.path.join( os.environ['CLINER_DIR'], "umls_tables/umls-lexicon" )
+    if not os.path.isfile( prefix + '.trie' ):
+        # Build (or finish migrating) umls.db first
+        resources.get('umls_db')
+        with build_lock( prefix ):
+            if not os.path.isfile( prefix + '.trie' ):
+                print "\ncreating umls-lexicon"
+                db_path = os.path.join( os.environ['CLINER_DIR'], "umls_tables/umls.db" )
+                umls_lexicon.build_lexicon( db_path, prefix )
+
+    return umls_lexicon.UmlsLexicon( prefix )
+
+
+#load (or build) the concept trie
+def TrieConnect():
+    filename = os.path.join( os.environ['CLINER_DIR'], "umls_tables/umls-concept.trie" )
+    with build_lock( filename ):
+        return create_trie.create_trie()
+
+
+def backend():
+    """ Which UMLS backend config.txt selects ('sqlite' or 'trie') """
+    return enabled_modules().get('UMLS_BACKEND') or 'sqlite'
 
 
 
@@ -42,11 +123,14 @@ def SQLConnect():
 ############################################
 
 
-# Global database connection
-c = SQLConnect()
+# Global database connection (opened on first lookup)
+resources.register('umls_db', SQLConnect)
+
+# Global trie (loaded on first lookup)
+resources.register('umls_trie', TrieConnect)
 
-# Global trie
-trie = create_trie.create_trie()
+# Global lexicon for the 'trie' backend (mapped on first lookup)
+resources.register('umls_lexicon', LexiconConnect)
 
 
 
@@ -58,23 +142,110 @@ trie = create_trie.create_trie()
 
 def string_lookup( string ):
     """ Get sty for a given string """
-    try:
-        c.execute( "SELECT sty FROM MRCON a, MRSTY b WHERE a.cui = b.cui AND str = ?; " , (string,) )
-        return c.fetchall()
-    except sqlite3.ProgrammingError, e:
-        return []
+    return lookup( 'STYS', string )
 
 
 def cui_lookup( string ):
     """ get cui for a given string """
+    return lookup( 'CUIS', string )
+
+
+def lookup( column, string ):
+    """ Read one packed column of UMLS_LOOKUP as a list of 1-tuples """
+    if backend() == 'trie':
+        return resources.get('umls_lexicon').lookup( column, string )
+    return sql_lookup( column, string )
+
+
+def sql_lookup( column, string ):
+    """ lookup() against the sqlite database """
+    c = resources.get('umls_db')
     try:
-        # Get cuis
-        c.execute( "SELECT cui FROM MRCON WHERE str = ?;" , (string,) )
-        return c.fetchall()
+        c.execute( "SELECT %s FROM UMLS_LOOKUP WHERE STR = ? ;" % column , (string,) )
+        row = c.fetchone()
+        return unpack( row[0] ) if row else []
     except sqlite3.ProgrammingError, e:
         return []
 
 
+def unpack( values ):
+    """ '|'-separated values -> list of 1-tuples (rows of a plain SELECT) """
+    if not values:
+        return []
+    return [ (value,) for value in values.split('|') ]
+
+
 def concept_exists(string):
     """ Fast query for set membership in trie """
-    return string in trie
+    if backend() == 'trie':
+        return string in resources.get('umls_lexicon')
+    return string in resources.get('umls_trie')
+
+
+def concept_prefix_exists(prefix):
+    """ Does any concept in the trie start with prefix? """
+    if backend() == 'trie':
+        return resources.get('umls_lexicon').has_prefix(prefix)
+    return resources.get('umls_trie').has_keys_with_prefix(prefix)
+
+
+
+############################################
+###             Bulk Operations          ###
+############################################
+
+
+def string_lookup_many( strings ):
+    """ Get sty for many strings with one query (string -> list of rows) """
+    return lookup_many( 'STYS', strings )
+
+
+def cui_lookup_many( strings ):
+    """ Get cui for many strings with one query (string -> list of rows) """
+    return lookup_many( 'CUIS', strings )
+
+
+def lookup_many( column, strings ):
+
+    """
+    lookup_many()
+
+    Purpose: Resolve a batch of strings in a single round-trip
+
+    @param column.  Packed column of UMLS_LOOKUP to read ('STYS' or 'CUIS')
+    @param strings. An iterable of strings to look up
+    @return         A dictionary mapping every string to a list of 1-tuples
+                    (same rows that string_lookup/cui_lookup would return)
+    """
+
+    results = {}
+    batch   = []
+    for string in strings:
+        if string in results: continue
+        results[string] = []
+
+        # sqlite refuses 8-bit bytestrings (the single lookups return [])
+        if isinstance(string, str) and any( ord(ch) > 127 for ch in string ):
+            continue
+        batch.append(string)
+
+    if not batch:
+        return results
+
+    # No round-trips to save: the lexicon is read in-process
+    if backend() == 'trie':
+        lexicon = resources.get('umls_lexicon')
+        for string in batch:
+            results[string] = lexicon.lookup( column, string )
+        return results
+
+    c = resources.get('umls_db')
+    c.execute( "CREATE TEMP TABLE IF NOT EXISTS lookup_strs( id INTEGER PRIMARY KEY, str ) ;" )
+    c.execute( "DELETE FROM lookup_strs ;" )
+    c.executemany( "INSERT INTO lookup_strs( id, str ) values( ?, ? )", enumerate(batch) )
+
+    c.execute( "SELECT l.id, m.%s FROM lookup_strs l, UMLS_LOOKUP m WHERE m.STR = l.str ;" % column )
+    for i,values in c:
+        results[batch[i]] = unpack( values )
+
+    return results
@@ -2,24 +2,114 @@ import cPickle as pickle
 import interface_umls
 
 
+# Defines the largest string span for the sentence.
+WINDOW_SIZE = 7
+
+
+def prefetch( cache, sentences, window=1 ):
+
+    """
+    prefetch()
+
+    Purpose: Resolve every uncached word and n-gram of the given sentences
+             with one bulk query per table, instead of one query per string
+
+    @param cache.     A UmlsCache
+    @param sentences. A list of sentences (each a list of words or chunks)
+    @param window.    The longest n-gram (in chunks) to prefetch
+    """
+
+    # Words queried by get_cui() and umls_semantic_type_word()
+    words = set()
+    for sentence in sentences:
+        for chunk in sentence:
+            words.add(chunk)
+            words.update(chunk.split())
+
+    # Spans queried by umls_semantic_type_sentence() and context_of_words()
+    spans = set(words)
+    for sentence in sentences:
+        for i in range(len(sentence)):
+            for j in range(i+2, min(i+window,len(sentence)) + 1):
+                rawstring = ' '.join(sentence[i:j])
+                spans.add(rawstring)
+                spans.add(rawstring.strip())
+
+    prefetch_sty( cache, spans )
+
+    keys    = dict( (w + '--cuis', w) for w in words )
+    cached  = cache.get_many( keys )
+    missing = [ w for k,w in keys.iteritems() if k not in cached ]
+    for word,rows in interface_umls.cui_lookup_many(missing).items():
+        cache.add_map( word + '--cuis', [ c[0] for c in set(rows) ] )
+
+
+def prefetch_sty( cache, strings ):
+    """ Fill the cache with the sty rows of every uncached string in one query """
+    keys    = dict( (s + '--sty', s) for s in strings )
+    cached  = cache.get_many( keys )
+    missing = [ s for k,s in keys.iteritems() if k not in cached ]
+    for string,rows in interface_umls.string_lookup_many(missing).items():
+        cache.add_map( string + '--sty', rows )
+
+
+def lookup_sty( cache, string ):
+    """ Get sty rows for a string (prefetched rows are read from the cache) """
+    if cache.has_key( string + '--sty' ):
+        return cache.get_map( string + '--sty' )
+
+    rows = interface_umls.string_lookup( string )
+    cache.add_map( string + '--sty', rows )
+    return rows
+
+
 def umls_semantic_type_word( umls_string_cache , sentence ):
-    # Already cached?
-    if False and umls_string_cache.has_key( sentence ):
-        mapping = umls_string_cache.get_map( sentence )
-    else:
-        concepts = interface_umls.string_lookup( sentence )
-        concepts = [  singleton[0]  for singleton  in set(concepts)  ]
-        umls_string_cache.add_map(sentence , concepts)
-        mapping = umls_string_cache.get_map(sentence)
+    concepts = lookup_sty( umls_string_cache, sentence )
+    mapping = [  singleton[0]  for singleton  in set(concepts)  ]
 
     return mapping
+
+
+def concept_spans( sentence ):
+
+    """
+    concept_spans()
+
+    Purpose: Find every span of at most WINDOW_SIZE tokens that is a UMLS
+             string, in one left-to-right scan that stops extending a span
+             as soon as no UMLS string starts with it
+
+    @param sentence. A list of words (or chunks)
+    @return          A list of (start,end) spans (inclusive), in (start,end) order
+    """
+
+    spans = []
+    for i in range(len(sentence)):
+        key = u''
+        for j in range( i , min(i+WINDOW_SIZE, len(sentence)) ):
+            try:
+                key += (u' ' if j > i else u'') + unicode(sentence[j])
+            except UnicodeDecodeError:
+                break
+
+            # string does have an associated UMLS concept?
+            if interface_umls.concept_exists(key):
+                spans.append( (i,j) )
+
+            # can any longer span still match?
+            if not interface_umls.concept_prefix_exists(key + u' '):
+                break
+
+    return spans
     
 
-def umls_semantic_context_of_words( umls_string_cache, sentence ):
-     
-    #Defines the largest string span for the sentence.
-    WINDOW_SIZE = 7
+def umls_semantic_context_of_words( umls_string_cache, sentence, spans=None ):
 
+    # candidate (start,end) spans (every other substring has no concept)
+    if spans is None:
+        spans = concept_spans( sentence )
+    candidates = set( spans )
+     
     # span of the umls concept of the largest substring
     umls_context_list = []
 
@@ -33,29 +123,19 @@ def umls_semantic_context_of_words( umls_string_cache, sentence ):
     # finds the span for each substring of length 1 to currentWindowSize. 
     for currentWindowSize in range( 1 , WINDOW_SIZE ):
         for ti in range( 0 , ( len(sentence) - currentWindowSize ) + 1 ): 
-            rawstring = "" 
-            for tj in range( ti , ti + currentWindowSize): 
-                rawstring += ( sentence[tj] + " " ) 
-            
+            if (ti,ti+currentWindowSize-1) not in candidates:
+                continue
+
             #Each string is of length 1 to currentWindowSize.
-            rawstring = rawstring.strip()
-
-            # Not in cache yet?
-            if not( umls_string_cache.has_key( rawstring ) ):
-                # returns a tuple if there is a result or None is there is not.  
-                concept = interface_umls.string_lookup( rawstring )
-                
-                if not concept:
-                    umls_string_cache.add_map( rawstring, None ) 
-                else:
-                    umls_string_cache.add_map( rawstring, concept ) ; 
-            
+            rawstring = ' '.join( sentence[ti:ti+currentWindowSize] ).strip()
+
             #Store the concept into concept_span_dict with its span as a key.
-            concept_span_dict[(ti,ti+currentWindowSize-1)] = umls_string_cache.get_map( rawstring )
+            concept = lookup_sty( umls_string_cache, rawstring ) or None
+            concept_span_dict[(ti,ti+currentWindowSize-1)] = concept
 
             # For each substring if there is a span, then
             #   assign the concept to every word that is within in the substring
-            if umls_string_cache.get_map(rawstring):
+            if concept:
                 for i in range( ti , ti + currentWindowSize ):  
                     if len( umls_context_list[i] ) == 0:
                         umls_context_list[i].append([ti,ti+currentWindowSize-1])
@@ -92,47 +172,18 @@ def umls_semantic_context_of_words( umls_string_cache, sentence ):
     return mappings 
 
 
-def umls_semantic_type_sentence( cache , sentence ):
+def umls_semantic_type_sentence( cache , sentence, spans=None ):
 
-    #Defines the largest string span for the sentence.
-    WINDOW_SIZE = 7
-
-    longestSpanLength = 0
-    longestSpans = []       # List of (start,end) tokens
-
-    for i in range(len(sentence)):
-        maxVal = min(i+WINDOW_SIZE, len(sentence))
-        for j in range(i,maxVal):
-            # Lookup key
-            span = sentence[i:j+1]
-            rawstring = unicode(' '.join(span))
-
-            # string does have an associated UMLS concept?
-            if interface_umls.concept_exists(rawstring):
-                if   len(span) == longestSpanLength:
-                    longestSpans.append( (i,j) )
-                # new longest span size
-                elif len(span) >  longestSpanLength:
-                    longestSpans = [ (i,j) ]
-                    longestSpanLength = len(span)
+    # List of (start,end) tokens of the longest spans with a concept
+    if spans is None:
+        spans = concept_spans( sentence )
+    longestSpanLength = max( [ j-i+1 for i,j in spans ] or [0] )
+    longestSpans = [ (i,j) for i,j in spans if j-i+1 == longestSpanLength ]
 
     # lookup UMLS concept for a given (start,end) span
     def span2concept(span):
         rawstring = ' '.join(sentence[span[0]:span[1]+1])
-
-        # Already cached?
-        if cache.has_key( rawstring ):
-            return cache.get_map( rawstring )
-
-        else:
-            concept = interface_umls.string_lookup( rawstring )
-
-            if concept:
-                cache.add_map( rawstring , concept )
-            else:
-                cache.add_map( rawstring  , [] )
-
-            return cache.get_map( rawstring )
+        return lookup_sty( cache, rawstring )
 
     mappings = [ span2concept(span) for span in longestSpans ]
     return mappings
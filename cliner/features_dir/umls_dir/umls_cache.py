@@ -1,30 +1,247 @@
-import cPickle as pickle
-import sys
+######################################################################
+#  CliNER - umls_cache.py                                            #
+#                                                                    #
+#  Purpose: Bounded cache of UMLS lookups: an in-memory LRU in front #
+#               of a persistent sqlite store shared by processes     #
+######################################################################
+
+
 import os
+import sqlite3
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+from multiprocessing import util
+
+from features_dir import resources
+from features_dir.read_config import enabled_modules
+
+
+# Entries kept in memory (UMLS_CACHE_SIZE in config.txt overrides it)
+DEFAULT_SIZE = 100000
 
-sys.path.append((os.environ["CLINER_DIR"] + "/cliner/features_dir"))
+# New entries written to disk per transaction
+FLUSH_SIZE = 1000
 
-from utilities import load_pickled_obj
 
 class UmlsCache:
-    def __init__(self):
-        try:
+
+    """
+    Same has_key/add_map/get_map interface as the old pickled dict, but:
+
+        - only the most recently used entries are kept in memory
+        - new entries are appended to umls_tables/umls_cache.db in batches
+          (never rewritten wholesale), so misses in memory fall back to disk
+        - every process opens its own connection (sqlite WAL mode), so
+          forked workers can read and write the store concurrently
+    """
+
+    def __init__(self, filename=None, size=None):
+
+        if filename is None:
             prefix = os.environ['CLINER_DIR']
-            self.filename = os.path.join( prefix, 'umls_tables/umls_cache' )
+            filename = os.path.join( prefix, 'umls_tables/umls_cache.db' )
+        if size is None:
+            size = int( enabled_modules().get('UMLS_CACHE_SIZE') or DEFAULT_SIZE )
+
+        self.filename = filename
+        self.size     = max(1, size)
+        self.memory   = OrderedDict()
+        self.pending  = {}
+        self.lock     = threading.RLock()
+
+        self.hits      = 0
+        self.disk_hits = 0
+        self.misses    = 0
 
-            self.cache = load_pickled_obj(self.filename)
+        # Connection of the process that opened it
+        self.pid  = None
+        self.conn = None
+
+        # Process whose pending entries this object writes out at exit
+        self.owner = None
+        self.claim()
+
+
+    def claim(self):
+
+        """
+        claim()
+
+        Purpose: Take over the cache in a forked worker (e.g. model.parallel_map).
+                 The parent keeps writing out the entries it had pending, so
+                 the worker drops its inherited copy and only writes out its
+                 own new entries, at its own exit (also multiprocessing workers).
+        """
+
+        if self.owner != os.getpid():
+            self.owner   = os.getpid()
+            self.pending = {}
+            util.Finalize(self, self.flush, exitpriority=10)
+
+
+    def connect(self):
+        if self.pid != os.getpid():
+            self.conn = sqlite3.connect( self.filename, timeout=60, check_same_thread=False )
+            self.conn.execute( "PRAGMA journal_mode = WAL ;" )
+            self.conn.execute( "CREATE TABLE IF NOT EXISTS CACHE( KEY PRIMARY KEY, VALUE ) WITHOUT ROWID ;" )
+            self.conn.commit()
+            self.pid = os.getpid()
+        return self.conn
 
-        except IOError:
-            self.cache = {}
 
     def has_key( self , string ):
-        return self.cache.has_key( string )
+        with self.lock:
+            if string in self.memory:
+                self.hits += 1
+                self.remember( string, self.memory[string] )
+                return True
+
+            if string in self.pending:
+                self.hits += 1
+                self.remember( string, self.pending[string] )
+                return True
+
+            c = self.connect().execute( "SELECT VALUE FROM CACHE WHERE KEY = ? ;", (db_key(string),) )
+            row = c.fetchone()
+            if row:
+                self.disk_hits += 1
+                self.remember( string, pickle.loads(str(row[0])) )
+                return True
+
+            self.misses += 1
+            return False
+
+
+    def get_many( self , strings ):
+
+        """
+        get_many()
+
+        Purpose: has_key()/get_map() for many keys at once: memory and pending
+                 entries first, then the rest in one query against the store
+
+        @param strings. An iterable of keys
+        @return         A dictionary of the cached ones: key -> mapping
+        """
+
+        with self.lock:
+            found  = {}
+            wanted = {}
+            for string in strings:
+                if string in self.memory:
+                    found[string] = self.memory[string]
+                elif string in self.pending:
+                    found[string] = self.pending[string]
+                else:
+                    wanted.setdefault( str(db_key(string)), [] ).append( string )
+            self.hits += len(found)
+
+            if wanted:
+                conn = self.connect()
+                conn.execute( "CREATE TEMP TABLE IF NOT EXISTS LOOKUP_KEYS( KEY PRIMARY KEY ) ;" )
+                conn.execute( "DELETE FROM LOOKUP_KEYS ;" )
+                conn.executemany( "INSERT INTO LOOKUP_KEYS( KEY ) values( ? )",
+                                  [ (sqlite3.Binary(key),) for key in wanted ] )
+                rows = conn.execute( """SELECT c.KEY, c.VALUE
+                                        FROM CACHE c JOIN LOOKUP_KEYS k ON c.KEY = k.KEY ;""" ).fetchall()
+                conn.commit()
+
+                for key,value in rows:
+                    mapping = pickle.loads(str(value))
+                    for string in wanted.pop(str(key)):
+                        found[string] = mapping
+                        self.disk_hits += 1
+
+            self.misses += sum( len(v) for v in wanted.values() )
+
+            for string,mapping in found.iteritems():
+                self.remember( string, mapping )
+            return found
+
 
     def add_map( self , string, mapping ):
-        self.cache[string] = mapping
+        with self.lock:
+            self.claim()
+            self.remember( string, mapping )
+            self.pending[string] = mapping
+            if len(self.pending) >= FLUSH_SIZE:
+                self.flush()
+
 
     def get_map( self , string ):
-        return self.cache[string]
+        with self.lock:
+            if (string not in self.memory) and not self.has_key(string):
+                raise KeyError(string)
+            return self.memory[string]
+
+
+    def remember(self, string, mapping):
+        """ Insert as the most recently used entry (evicting the least) """
+        self.memory.pop(string, None)
+        self.memory[string] = mapping
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+
+    def flush(self):
+        """ Append pending entries to the on-disk store in one transaction """
+        with self.lock:
+            if (not self.pending) or (self.owner != os.getpid()):
+                return
+            rows = [ (db_key(k), sqlite3.Binary(pickle.dumps(v,-1)))
+                     for k,v in self.pending.iteritems() ]
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.executemany( "INSERT OR REPLACE INTO CACHE( KEY, VALUE ) values( ?, ? )", rows )
+                self.pending = {}
+            except sqlite3.OperationalError:
+                # Store busy for too long: keep the entries for next time
+                pass
+
+
+    def stats(self):
+
+        """
+        stats()
+
+        @return dictionary of lookup counts (memory hits, disk hits, misses)
+                and the fraction of lookups answered without UMLS
+        """
+
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return { 'hits'     : self.hits                       ,
+                     'disk_hits': self.disk_hits                  ,
+                     'misses'   : self.misses                     ,
+                     'hit_rate' : (self.hits + self.disk_hits) / float(lookups or 1),
+                     'entries'  : len(self.memory)                }
+
+
+
+def db_key(string):
+
+    """
+    db_key()
+
+    Purpose: Blob key for the store (equal strings give equal keys, as in
+             a dict, and 8-bit strings need not decode)
+
+    >>> db_key('pain') == db_key(u'pain')
+    True
+    >>> db_key('caf\\xc3\\xa9') == db_key(u'caf\\xe9')
+    False
+    """
+
+    if isinstance(string, str):
+        try:
+            string = string.decode('ascii')
+        except UnicodeDecodeError:
+            return sqlite3.Binary('b:' + string)
+    return sqlite3.Binary('u:' + string.encode('utf-8'))
+
+
 
-    def __del__(self):
-        pickle.dump( self.cache, open( self.filename, "wb" ) )
+# One cache per process, shared by every UMLSFeatures object
+resources.register('umls_cache', UmlsCache)
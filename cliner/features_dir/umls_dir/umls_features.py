@@ -8,7 +8,8 @@
 
 
 
-from umls_cache import UmlsCache
+from features_dir import resources
+import umls_cache           # registers the umls_cache resource
 import interpret_umls
 
 
@@ -22,8 +23,27 @@ class UMLSFeatures:
         UMLSFeatures::Constructor
         """
 
-        # cache for the mappings of all umls lookups made
-        self.umls_lookup_cache = UmlsCache()
+        # cache for the mappings of all umls lookups made (shared per process)
+        self.umls_lookup_cache = resources.get('umls_cache')
+
+        # sentence-level features of the last sentence (shared by its chunks)
+        self.last_sentence = (None, None)
+
+
+
+    def prefetch(self, sentences, window=1):
+
+        """
+        UMLSFeatures::prefetch()
+
+        Purpose: Fill the lookup cache for many sentences (e.g. a whole
+                 note) with one bulk query, rather than one per string
+
+        @ param sentences. A list of sentences (each a list of words)
+        @ param window.    The longest n-gram to look up
+        """
+
+        interpret_umls.prefetch(self.umls_lookup_cache, sentences, window)
 
 
 
@@ -38,6 +58,8 @@ class UMLSFeatures:
 
         features_list = []
 
+        self.prefetch( [sentence] )
+
         for word in sentence:
             features_list.append( self.features_for_word(word) )
 
@@ -56,6 +78,8 @@ class UMLSFeatures:
 
         features_list = []
 
+        self.prefetch( [sentence] )
+
         for word in sentence:
             features_list.append( self.features_for_word(word) )
 
@@ -147,9 +171,39 @@ class UMLSFeatures:
             features.update(word_feats)
         
 
+        # Features: UMLS semantic type / context for the whole sentence
+        features.update( self.sentence_features(sentence) )
+
+        return features
+
+
+
+    def sentence_features(self, sentence):
+
+        """
+        UMLSFeatures::sentence_features()
+
+        Purpose: Sentence-level features, computed once per sentence (every
+                 chunk of the sentence shares them)
+
+        @ param sentence. list of words from line (after flattening chunks)
+        @return           dictionary of sentence-level features
+        """
+
+        key = tuple(sentence)
+        if self.last_sentence[0] == key:
+            return self.last_sentence[1]
+
+        features = {}
+
+        # One scan of the sentence finds every span with a concept
+        spans = interpret_umls.concept_spans( sentence )
+        interpret_umls.prefetch_sty( self.umls_lookup_cache,
+                [ ' '.join(sentence[i:j+1]) for i,j in spans ] )
+
         # Feature: UMLS semantic type for the sentence
         # a list of the uml semantic of the largest substring(s).
-        sentence_mapping = interpret_umls.umls_semantic_type_sentence( self.umls_lookup_cache, sentence )
+        sentence_mapping = interpret_umls.umls_semantic_type_sentence( self.umls_lookup_cache, sentence, spans )
 
         # if there are no mappings
         if not sentence_mapping:
@@ -164,7 +218,7 @@ class UMLSFeatures:
         # Feature: UMLS semantic context
 
         # the umls definition of the largest string the word is in
-        umls_semantic_context_mappings = interpret_umls.umls_semantic_context_of_words( self.umls_lookup_cache , sentence )
+        umls_semantic_context_mappings = interpret_umls.umls_semantic_context_of_words( self.umls_lookup_cache , sentence, spans )
 
         # there could be multiple contexts, iterate through the sublist
         for mapping in umls_semantic_context_mappings:
@@ -172,11 +226,13 @@ class UMLSFeatures:
             for concept in mapping:
                 features[('umls_semantic_context',concept)] = 1
 
+        self.last_sentence = (key, features)
         return features
 
 
 
     def concept_features_for_chunks(self, sentence, inds):
+        self.prefetch( [sentence] )
         retVal = []
         for ind in inds:
             retVal.append( self.concept_features_for_chunk(sentence, ind) )
@@ -0,0 +1,155 @@
+######################################################################
+#  CliNER - umls_lexicon.py                                          #
+#                                                                    #
+#  Purpose: UMLS string -> (CUIs, semantic types) lexicon compiled   #
+#               into memory-mapped marisa tries (no sqlite calls)    #
+######################################################################
+
+
+import sqlite3
+import marisa_trie
+
+
+# Each string record is (kind, id): the id of one of its CUIs or stys
+RECORD_FORMAT = '<BI'
+
+CUI = 0
+STY = 1
+
+
+class UmlsLexicon:
+
+    """
+    Read-only lexicon over three mmap'ed trie files:
+
+        <prefix>.trie       string -> (kind, id) records
+        <prefix>-cuis.trie  CUI names (id = key id)
+        <prefix>-stys.trie  semantic type names (id = key id)
+
+    Opening costs nothing up front, and every forked worker shares one
+    physical copy through the page cache.
+    """
+
+    def __init__(self, prefix):
+        self.strings = marisa_trie.RecordTrie(RECORD_FORMAT).mmap(prefix + '.trie')
+        self.names   = { CUI: marisa_trie.Trie().mmap(prefix + '-cuis.trie'),
+                         STY: marisa_trie.Trie().mmap(prefix + '-stys.trie') }
+
+
+    def string_lookup(self, string):
+        """ Get sty for a given string """
+        return self.lookup('STYS', string)
+
+
+    def cui_lookup(self, string):
+        """ get cui for a given string """
+        return self.lookup('CUIS', string)
+
+
+    def lookup(self, column, string):
+
+        """
+        lookup()
+
+        @param column. 'STYS' or 'CUIS' (as for interface_umls.lookup)
+        @param string. The string to look up
+        @return        A list of 1-tuples, like rows of the sqlite backend
+        """
+
+        key = normalize(string)
+        if key is None:
+            return []
+
+        kind  = STY if column == 'STYS' else CUI
+        names = self.names[kind]
+        return [ (names.restore_key(i),) for k,i in self.strings.get(key, []) if k == kind ]
+
+
+    def __contains__(self, string):
+        key = normalize(string)
+        return key is not None and key in self.strings
+
+
+    def has_prefix(self, prefix):
+        """ Does any string in the lexicon start with prefix? """
+        key = normalize(prefix)
+        return key is not None and self.strings.has_keys_with_prefix(key)
+
+
+
+def normalize(string):
+
+    """
+    normalize()
+
+    Purpose: Trie key for a lookup string (None if it can never match,
+             which mirrors sqlite refusing 8-bit bytestrings)
+
+    >>> normalize('chest pain')
+    u'chest pain'
+    >>> normalize('caf\\xc3\\xa9') is None
+    True
+    """
+
+    try:
+        return unicode(string)
+    except UnicodeDecodeError:
+        return None
+
+
+
+def build_lexicon(db_path, prefix):
+
+    """
+    build_lexicon()
+
+    Purpose: Compile the UMLS_LOOKUP table of umls.db into trie files,
+             streaming rows from sqlite (the table is never held in memory)
+
+    @param db_path. Path to a built umls.db
+    @param prefix.  Path prefix of the files to write
+    @return         A UmlsLexicon over the new files
+    """
+
+    # Strings were stored as raw bytes from the UMLS files
+    conn = sqlite3.connect( db_path )
+    conn.text_factory = str
+    c = conn.cursor()
+
+    # Name tables first: the string trie marks a finished build
+    c.execute( "SELECT DISTINCT CUI FROM MRCON WHERE STR IS NOT NULL ;" )
+    cuis = marisa_trie.Trie( row[0].decode('utf-8') for row in c )
+    c.execute( "SELECT DISTINCT STY FROM MRSTY ;" )
+    stys = marisa_trie.Trie( row[0].decode('utf-8') for row in c )
+    cuis.save(prefix + '-cuis.trie')
+    stys.save(prefix + '-stys.trie')
+
+    skipped = [0]
+    def records():
+        # Primary key order: sorted by STR
+        c.execute( "SELECT STR, CUIS, STYS FROM UMLS_LOOKUP ORDER BY STR ;" )
+        for s,cs,ss in c:
+            # Same as sqlite lookups: non-UTF-8 strings can never match
+            try:
+                s = s.decode('utf-8')
+            except UnicodeDecodeError:
+                skipped[0] += 1
+                continue
+            for cui in split(cs):
+                yield ( s, (CUI, cuis[cui.decode('utf-8')]) )
+            for sty in split(ss):
+                yield ( s, (STY, stys[sty.decode('utf-8')]) )
+
+    marisa_trie.RecordTrie(RECORD_FORMAT, records()).save(prefix + '.trie')
+    conn.close()
+
+    if skipped[0]:
+        print "skipped %d strings that are not UTF-8" % skipped[0]
+
+    return UmlsLexicon(prefix)
+
+
+
+def split(values):
+    """ '|'-separated UMLS_LOOKUP column -> list of values """
+    return values.split('|') if values else []
@@ -11,13 +11,12 @@ import re
 import cPickle as pickle
 import os
 
+from features_dir import resources
+
 
 # used as a default path for stashing pos tagger.
 pos_tagger_path = os.path.join( os.environ['CLINER_DIR'], "cliner/features_dir/nltk_tagger.p")
 
-if not os.path.isfile(pos_tagger_path):
-    import nltk.data, nltk.tag
-
 def load_pickled_obj(path_to_pickled_obj):
 
     data = None
@@ -40,6 +39,8 @@ def pickle_dump(obj, path_to_obj):
 
 def dump_pos_tagger(path_to_obj):
 
+    import nltk.data, nltk.tag
+
     tagger = nltk.data.load(nltk.tag._POS_TAGGER)
 
     pickle_dump(tagger, path_to_obj)
@@ -65,6 +66,9 @@ def load_pos_tagger(path_to_obj=pos_tagger_path):
 
     return tagger
 
+# Shared tagger, loaded on first use: resources.get('pos_tagger')
+resources.register('pos_tagger', load_pos_tagger)
+
 def is_prose_sentence(sentence):
     """
     is_prose_sentence()
@@ -160,9 +164,3 @@ def is_prose_word(word):
 
     # Else
     return True
-<<<<<<< HEAD
-
-
-#EOF
-=======
->>>>>>> doctests
@@ -0,0 +1,130 @@
+######################################################################
+#  CliNER - word_cache.py                                            #
+#                                                                    #
+#  Purpose: Bounded per-token memo of word-level feature values      #
+#               (stems, word shapes, regex flags) shared by every    #
+#               WordFeatures object in a process                     #
+######################################################################
+
+
+import threading
+from collections import OrderedDict
+
+from features_dir import resources
+from features_dir.read_config import enabled_modules
+
+
+# Words kept per feature type (WORD_CACHE_SIZE in config.txt overrides it)
+DEFAULT_SIZE = 50000
+
+
+class WordCache:
+
+    """
+    One LRU table per feature type, each mapping word -> feature value.
+
+        - values depend only on the token string, so a repeated token costs
+          a dict lookup instead of stemming, shaping and regex matching
+        - each table holds at most `size` words (least recently used go first)
+        - keys are interned, so a token shares one copy across tables
+    """
+
+    def __init__(self, size=None):
+
+        if size is None:
+            size = int( enabled_modules().get('WORD_CACHE_SIZE') or DEFAULT_SIZE )
+
+        self.size   = max(1, size)
+        self.tables = {}
+        self.hits   = {}
+        self.misses = {}
+        self.lock   = threading.Lock()
+
+
+    def get(self, kind, word, compute):
+
+        """
+        get()
+
+        Purpose: Memoized compute(word) for one feature type
+
+        @param kind.    Name of the feature type (one table per name)
+        @param word.    The token
+        @param compute. Function of the token giving the feature value
+        @return         compute(word), from the cache when possible
+
+        >>> cache = WordCache(size=2)
+        >>> cache.get('upper', 'ab', str.upper)
+        'AB'
+        >>> cache.get('upper', 'ab', None)
+        'AB'
+        >>> cache.stats()['upper']['hits']
+        1
+        """
+
+        with self.lock:
+            table = self.tables.get(kind)
+            if table is None:
+                table = self.tables[kind] = OrderedDict()
+                self.hits[kind]   = 0
+                self.misses[kind] = 0
+
+            # Hit: move to the most recently used end
+            if word in table:
+                self.hits[kind] += 1
+                value = table.pop(word)
+                table[word] = value
+                return value
+
+        value = compute(word)
+
+        with self.lock:
+            self.misses[kind] += 1
+            table[intern_word(word)] = value
+            while len(table) > self.size:
+                table.popitem(last=False)
+        return value
+
+
+    def stats(self):
+
+        """
+        stats()
+
+        @return dictionary of feature type -> lookup counts (hits, misses),
+                hit rate and number of cached words
+        """
+
+        with self.lock:
+            counts = {}
+            for kind,table in self.tables.items():
+                hits, misses = self.hits[kind], self.misses[kind]
+                counts[kind] = { 'hits'    : hits                                  ,
+                                 'misses'  : misses                                ,
+                                 'hit_rate': hits / float(hits + misses or 1)      ,
+                                 'entries' : len(table)                            }
+            return counts
+
+
+
+def intern_word(word):
+
+    """
+    intern_word()
+
+    Purpose: Interned copy of a bytestring token (unicode can't be interned)
+
+    >>> intern_word('pain') is intern_word(''.join(['pa','in']))
+    True
+    >>> intern_word(u'pain')
+    u'pain'
+    """
+
+    if type(word) is str:
+        return intern(word)
+    return word
+
+
+
+# One cache per process, shared by every WordFeatures object
+resources.register('word_cache', WordCache)
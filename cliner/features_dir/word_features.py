@@ -16,12 +16,70 @@ import re
 import os
 import sys
 
+from features_dir import resources
 from wordshape import getWordShapes
 from nltk import LancasterStemmer, PorterStemmer
 
+import word_cache                   # registers the word_cache resource
+
 lancaster_st = LancasterStemmer()
 porter_st = PorterStemmer()
 
+
+
+def combine(patterns):
+
+    """
+    combine()
+
+    Purpose: Compile {name: regex} into one regex whose match() sets the
+             named group of every pattern that re.search() would find
+             (each pattern is an optional lookahead, so one call at the
+             start of the string tests all of them)
+
+    @param patterns. A dictionary of {name: regex string}
+    @return          A compiled regex
+
+    >>> r = combine( {'A': r'^a', 'B': r'b$', 'C': r'c'} )
+    >>> sorted( flags(r, 'abc') )
+    ['A', 'C']
+    """
+
+    parts = [ r'(?:(?=[\s\S]*?(?P<%s>%s))|)' % (name, pattern)
+              for name,pattern in sorted(patterns.items()) ]
+    return re.compile(''.join(parts))
+
+
+
+def flags(regex, word):
+    """ Names of the patterns of a combine()d regex that match word """
+    groups = regex.match(word).groupdict()
+    return [ name for name,value in groups.iteritems() if value is not None ]
+
+
+
+# Word-level feature values (memoized per token by WordCache)
+
+def stem_lancaster(word):
+    return lancaster_st.stem(word.lower())
+
+def stem_porter(word):
+    return porter_st.stem(word)
+
+def generic(word):
+    return WordFeatures.digit_regex.sub('0', word)
+
+def word_shapes(word):
+    return tuple( getWordShapes(word) )
+
+def mitre_flags(word):
+    return tuple( flags(WordFeatures.mitre_regex, word) )
+
+def qann_flags(word):
+    return frozenset( flags(WordFeatures.qann_regex, word) )
+
+
+
 class WordFeatures:
 
     enabled_IOB_prose_word_features = frozenset( ['Generic#', 'last_two_letters', 'word', 'length', 'mitre', 'stem_porter', 'stem_lancaster', 'word_shape', 'metric_unit' ] )
@@ -33,7 +91,8 @@ class WordFeatures:
 
 
     def __init__(self):
-        pass
+        # Per-token memo of the features below, shared by the whole process
+        self.cache = resources.get('word_cache')
 
 
     def IOB_prose_features(self, word):
@@ -59,12 +118,11 @@ class WordFeatures:
                 features[(feature, word.lower())] = 1
 
             if feature == "stem_lancaster":
-                features[ (feature, lancaster_st.stem(word.lower())) ] = 1
+                features[ (feature, self.cache.get(feature, word, stem_lancaster)) ] = 1
 
             # Feature: Generic# stemmed word
             if feature == 'Generic#':
-                generic = re.sub('[0-9]','0',word)
-                features[ ('Generic#',generic) ] = 1
+                features[ ('Generic#',self.cache.get(feature, word, generic)) ] = 1
 
             # Feature: Last two leters of word
             if feature == 'last_two_letters':
@@ -75,16 +133,15 @@ class WordFeatures:
                 features[(feature, None)] = len(word)
 
             if feature == "stem_porter":
-                features[(feature, porter_st.stem(word))] = 1
+                features[(feature, self.cache.get(feature, word, stem_porter))] = 1
 
 
             if feature == "mitre":
-                for f in self.mitre_features:
-                    if re.search(self.mitre_features[f], word):
-                        features[(feature, f)] = 1
+                for f in self.cache.get('mitre', word, mitre_flags):
+                    features[(feature, f)] = 1
 
             if feature == "word_shape":
-                wordShapes = getWordShapes(word)
+                wordShapes = self.cache.get('word_shape', word, word_shapes)
                 for shape in wordShapes:
                     features[(feature, shape)] = 1
 
@@ -116,13 +173,12 @@ class WordFeatures:
 
             # Feature: Mitre
             if feature == "mitre":
-                for f in self.mitre_features:
-                    if re.search(self.mitre_features[f], word):
-                        features[('mitre', f)] = 1
+                for f in self.cache.get('mitre', word, mitre_flags):
+                    features[('mitre', f)] = 1
 
             # Feature: Word Shape
             if feature == "word_shape":
-                wordShapes = getWordShapes(word)
+                wordShapes = self.cache.get('word_shape', word, word_shapes)
                 for shape in wordShapes:
                     features[('word_shape', shape)] = 1
 
@@ -190,11 +246,12 @@ class WordFeatures:
             # Feature: Metric Unit
             if feature == "metric_unit":
                 unit = None
-                if self.is_weight(word):
+                matched = self.cache.get('QANN', word, qann_flags)
+                if 'weight' in matched:
                     unit = 'weight'
-                elif self.is_size(word):
+                elif 'size' in matched:
                     unit = 'size'
-                elif self.is_volume(word):
+                elif 'volume' in matched:
                     unit = 'volume'
                 features[('metric_unit',unit)] = 1
 
@@ -297,6 +354,31 @@ class WordFeatures:
         "DATESEPERATOR": r"^[-/]$",
     }
 
+    # All mitre patterns in one regex (see combine)
+    mitre_regex = combine(mitre_features)
+
+
+    # Patterns behind QANN_features and the is_*/has_* checks
+    qann_patterns = {
+        "test_result": r"^[A-Za-z]+( )*(-|--|:|was|of|\*|>|<|more than|less than)( )*[0-9]+(%)*",
+        "test_result_was": r"^[A-Za-z]+ was (positive|negative)",
+        "measurement": r"^[0-9]*( )?(unit(s)|cc|L|mL|dL)$",
+        "directive": r"^(q\..*|q..|PRM|bid|prm|p\..*)$",
+        "date": r'^(\d\d\d\d-\d\d-\d|\d\d?-\d\d?-\d\d\d\d?|\d\d\d\d-\d\d?-\d\d?)$',
+        "volume": r"^[0-9]*( )?(ml|mL|dL)$",
+        "weight": r"^[0-9]*( )?(mg|g|mcg|milligrams|grams)$",
+        "size": r"^[0-9]*( )?(mm|cm|millimeters|centimeters)$",
+        "prognosis_location": r"^(c|C)[0-9]+(-(c|C)[0-9]+)*$",
+        "problem_form": r".*(ic|is)$",
+    }
+
+    # Compiled once, both individually and combined
+    qann_compiled = dict( (name,re.compile(p)) for name,p in qann_patterns.items() )
+    qann_regex    = combine(qann_patterns)
+
+    digit_regex = re.compile('[0-9]')
+
+
     # Try to get QANN features
     def QANN_features(self, word):
         """
@@ -314,35 +396,39 @@ class WordFeatures:
                                                                       
         features = {}
 
+        # One regex scan for every flag (once per distinct word)
+        matched = self.cache.get('QANN', word, qann_flags)
+
         # Feature: test result
-        if self.is_test_result(word):    features[('test_result',None)] = 1
+        if ('test_result' in matched) or ('test_result_was' in matched):
+                                         features[('test_result',None)] = 1
 
         # Feature: measurements
-        if self.is_measurement(word):    features[('measurement',None)] = 1
+        if 'measurement' in matched:     features[('measurement',None)] = 1
 
         # Feature: directive
-        if self.is_directive(word):      features[('directive',  None)] = 1
+        if 'directive' in matched:       features[('directive',  None)] = 1
 
         # Feature: date
-        if self.is_date(word):           features[('date',       None)] = 1
+        if 'date' in matched:            features[('date',       None)] = 1
 
         # Feature: volume
-        if self.is_volume(word):         features[('volume',     None)] = 1
+        if 'volume' in matched:          features[('volume',     None)] = 1
 
         # Feature: weight
-        if self.is_weight(word):         features[('weight',     None)] = 1
+        if 'weight' in matched:          features[('weight',     None)] = 1
 
         # Feature: size
-        if self.is_size(word):           features[('size',       None)] = 1
+        if 'size' in matched:            features[('size',       None)] = 1
 
         # Feature: prognosis location
         if self.is_prognosis_location:   features[('prog_location', None)] = 1
 
         # Feature: problem form
-        if self.has_problem_form(word):  features[('problem_form',     None)] = 1
+        if 'problem_form' in matched:    features[('problem_form',     None)] = 1
 
         # Feature: concept class
-        if self.is_weight(word):         features[('weight',     None)] = 1
+        if 'weight' in matched:          features[('weight',     None)] = 1
 
         return features
 
@@ -370,9 +456,8 @@ class WordFeatures:
         >>> print wf.is_test_result(' ')
         None
         """
-        regex = r"^[A-Za-z]+( )*(-|--|:|was|of|\*|>|<|more than|less than)( )*[0-9]+(%)*"
-        if not re.search(regex, context):
-            return re.search(r"^[A-Za-z]+ was (positive|negative)", context)
+        if not self.qann_compiled['test_result'].search(context):
+            return self.qann_compiled['test_result_was'].search(context)
         return True
 
     def is_measurement(self, word):
@@ -404,8 +489,7 @@ class WordFeatures:
         >>> wf.is_measurement('units') is not None
         True
         """
-        regex = r"^[0-9]*( )?(unit(s)|cc|L|mL|dL)$"
-        return re.search(regex, word)
+        return self.qann_compiled['measurement'].search(word)
 
     def is_directive(self, word):
         """
@@ -434,8 +518,7 @@ class WordFeatures:
         >>> wf.is_directive('BID') is not None 
         False
         """
-        regex = r"^(q\..*|q..|PRM|bid|prm|p\..*)$"
-        return re.search(regex, word)
+        return self.qann_compiled['directive'].search(word)
 
     def is_date(self, word):
         """
@@ -458,8 +541,7 @@ class WordFeatures:
         >>> wf.is_date('0') is not None
         False
         """
-        regex= r'^(\d\d\d\d-\d\d-\d|\d\d?-\d\d?-\d\d\d\d?|\d\d\d\d-\d\d?-\d\d?)$'
-        return re.search(regex,word)
+        return self.qann_compiled['date'].search(word)
 
     def is_volume(self, word):
         """
@@ -482,8 +564,7 @@ class WordFeatures:
         >>> wf.is_volume('ml') is not None
         True
         """
-        regex = r"^[0-9]*( )?(ml|mL|dL)$"
-        return re.search(regex, word)
+        return self.qann_compiled['volume'].search(word)
 
     def is_weight(self, word):
         """
@@ -510,8 +591,7 @@ class WordFeatures:
         >>> wf.is_weight('grams') is not None
         True
         """
-        regex = r"^[0-9]*( )?(mg|g|mcg|milligrams|grams)$"
-        return re.search(regex, word)
+        return self.qann_compiled['weight'].search(word)
 
     def is_size(self, word):
         """
@@ -538,8 +618,7 @@ class WordFeatures:
         >>> wf.is_size('millimeters') is not None  
         True
         """
-        regex = r"^[0-9]*( )?(mm|cm|millimeters|centimeters)$"
-        return re.search(regex, word)
+        return self.qann_compiled['size'].search(word)
 
     def is_prognosis_location(self, word):
         """
@@ -560,8 +639,7 @@ class WordFeatures:
         >>> wf.is_prognosis_location('c-9-C5') is not None
         False
         """
-        regex = r"^(c|C)[0-9]+(-(c|C)[0-9]+)*$"
-        return re.search(regex, word)
+        return self.qann_compiled['prognosis_location'].search(word)
 
     def has_problem_form(self, word):
         """
@@ -586,8 +664,7 @@ class WordFeatures:
         >>> wf.has_problem_form('ice') is not None
         False
         """
-        regex = r".*(ic|is)$"
-        return re.search(regex, word)
+        return self.qann_compiled['problem_form'].search(word)
 
     def get_def_class(self, word):
         """
@@ -30,7 +30,7 @@ def create_filename(odir, bfile, extension):
 
 
 
-def main():
+def main(argv=None):
 
     # Argument Parser
     parser = argparse.ArgumentParser()
@@ -57,7 +57,7 @@ def main():
     )
 
     # Parse the command line arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
 
     # Parse arguments
@@ -10,12 +10,107 @@
 import sys
 import os
 import tempfile
+import threading
 import pycrfsuite
-
-count = 0
+from itertools import izip
 
 tmp_dir = os.path.join(os.environ["CLINER_DIR"], "cliner/tmp_files_dir")
 
+def feature_name(key):
+
+    """
+    feature_name()
+
+    Purpose: Turn a (name, value) feature key into a crfsuite attribute name
+
+    @param key. A feature key, as used by the feature dictionaries
+    @return     A string
+
+    >>> feature_name(('word', 'pain'))
+    'word=pain'
+    >>> feature_name('dummy')
+    'dummy'
+    """
+
+    if isinstance(key, tuple):
+        return '='.join( [ '%s' % k for k in key ] )
+    return '%s' % key
+
+
+
+def dicts_to_items(fset):
+
+    """
+    dicts_to_items()
+
+    Purpose: Build crfsuite sequences straight from feature dictionaries
+               (no DictVectorizer involved)
+
+    @param fset. A list of sentences (each a list of feature dicts)
+    @return      A list of pycrfsuite.ItemSequence objects
+    """
+
+    seqs = []
+    for sentence in fset:
+        items = [ dict( (feature_name(k),v) for k,v in feats.iteritems() )
+                  for feats in sentence ]
+        seqs.append( pycrfsuite.ItemSequence(items) )
+    return seqs
+
+
+
+def sparse_to_items(X, offsets):
+
+    """
+    sparse_to_items()
+
+    Purpose: Build crfsuite sequences from a vectorized feature matrix
+
+    @param X.       A scipy sparse matrix (one row per word)
+    @param offsets. Cumulative sentence lengths (end row of each sentence)
+    @return         A list of pycrfsuite.ItemSequence objects
+    """
+
+    # Walk the CSR arrays directly rather than indexing row by row
+    X = X.tocsr()
+    indptr  = X.indptr
+    indices = X.indices
+    data    = X.data
+
+    seqs  = []
+    start = 0
+    for end in offsets:
+        items = []
+        for row in xrange(start, end):
+            lo,hi = indptr[row], indptr[row+1]
+            names = [ str(k) for k in indices[lo:hi] ]
+            items.append( dict(zip(names, data[lo:hi].tolist())) )
+        seqs.append( pycrfsuite.ItemSequence(items) )
+        start = end
+
+    return seqs
+
+
+
+def legacy_items(X, offsets):
+
+    """
+    legacy_items()
+
+    Purpose: Format features the way models trained before ItemSequence
+               support expect them ('%d=%d' attribute strings)
+
+    @param X.       A scipy sparse matrix (one row per word)
+    @param offsets. Cumulative sentence lengths (end row of each sentence)
+    @return         A list of lists of attribute strings
+    """
+
+    X = list(X)
+    X = [ X[i:j] for i, j in zip([0] + offsets, offsets)]
+    return list(pycrf_instances(format_features(X), labeled=False))
+
+
+
 def format_features(rows, labels=None):
 
     retVal = []
@@ -43,21 +138,6 @@ def format_features(rows, labels=None):
         # Sentence boundary seperator
         retVal.append('')
 
-    '''
-    # Sanity check
-    global count
-    if labels:
-        out_f = 'a.txt' + str(count)
-        start =  0 # 2
-    else:
-        out_f = 'b.txt' + str(count)
-        start = 0
-    count += 1
-    with open(out_f, 'w') as f:
-        for line in retVal:
-            print >>f, line[start:]
-    '''
-
     return retVal
 
 
@@ -101,22 +181,19 @@ def pycrf_instances(fi, labeled):
 
 def train(X, Y, do_grid):
 
-    # Sanity Check detection: features & label
-    #with open('a','w') as f:
-    #    for xline,yline in zip(X,Y):
-    #        for x,y in zip(xline,yline):
-    #            print >>f, y, '\t', x.nonzero()[1][0]
-    #        print >>f
-
-
-    # Format features fot crfsuite
-    feats = format_features(X,Y)
+    """
+    train()
 
+    @param X.       A list (or stream) of item sequences (one per sentence)
+    @param Y.       A list (or stream) of lists of integer labels (1:1 with X)
+    @param do_grid. A boolean indicating whether to perform a grid search
+    @return         The trained crfsuite model (as a string)
+    """
 
     # Create a Trainer object.
     trainer = pycrfsuite.Trainer(verbose=False)
-    for xseq, yseq in pycrf_instances(feats, labeled=True):
-        trainer.append(xseq, yseq)
+    for xseq, yseq in izip(X, Y):
+        trainer.append(xseq, [ str(y) for y in yseq ])
 
 
     # Set paramters
@@ -145,10 +222,56 @@ def train(X, Y, do_grid):
 
 
 
-def predict(clf, X):
+class ModelFile:
+
+    """
+    A crfsuite model that stays on disk (e.g. inside a model bundle),
+    so a tagger can open it in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+
+class CachedTagger:
+
+    """
+    A pycrfsuite Tagger that is opened once and shared across predict calls.
+
+    The serialized model is only written/parsed when the tagger is built.
+    Tagging is guarded by a lock, because crfsuite taggers keep per-sequence
+    state and cannot be used by two threads at once.
+    """
+
+    def __init__(self, clf):
+        self.tagger = open_tagger(clf)
+        self.lock   = threading.Lock()
+
+    def tag(self, xseq):
+        with self.lock:
+            return self.tagger.tag(xseq)
+
+
+
+def open_tagger(clf):
+
+    # Create the Tagger object
+    tagger = pycrfsuite.Tagger()
+
+    # Model file on disk: nothing to write out first
+    if isinstance(clf, ModelFile):
+        tagger.open(clf.path)
+        return tagger
 
-    # Format features fot crfsuite
-    feats = format_features(X)
+    # Newer python-crfsuite can read the model straight from memory
+    if hasattr(tagger, 'open_inmemory'):
+        tagger.open_inmemory(clf)
+        return tagger
 
     # Dump the model into a temp file
     tmp_file = tempfile.mkstemp(dir=tmp_dir, suffix="crf_temp")[1]
@@ -156,30 +279,36 @@ def predict(clf, X):
     with open(tmp_file, 'wb') as f:
         f.write(clf)
 
-
-    # Create the Tagger object
-    tagger = pycrfsuite.Tagger()
     tagger.open(tmp_file)
 
-
     # Remove the temp file
     os.remove(tmp_file)
 
+    return tagger
+
+
+
+
+def predict(clf, X):
+
+    """
+    predict()
+
+    @param clf. A serialized crfsuite model, a ModelFile or a CachedTagger
+    @param X.   A list of item sequences (one per sentence)
+    @return     A flat list of predicted labels
+    """
+
+    # Only open a new tagger if the caller did not cache one
+    if isinstance(clf, CachedTagger):
+        tagger = clf
+    else:
+        tagger = open_tagger(clf)
+
 
     # Tag the sequence
     retVal = []
-    Y = []
-    for xseq in pycrf_instances(feats, labeled=False):
-        yseq = [ int(n) for n in tagger.tag(xseq) ]
-        retVal += list(yseq)
-        Y.append(list(yseq))
-
-    # Sanity Check detection: feature & label predictions
-    #with open('a','w') as f:
-    #    for x,y in zip(xseq,Y):
-    #        x = x[0]
-    #        print >>f, y, '\t', x[:-2]
-    #    print >>f
-
+    for xseq in X:
+        retVal += [ int(n) for n in tagger.tag(xseq) ]
 
     return retVal
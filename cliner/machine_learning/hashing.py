@@ -0,0 +1,56 @@
+######################################################################
+#  CliNER - hashing.py                                               #
+#                                                                    #
+#  Purpose: Stateless drop-in for DictVectorizer (feature hashing)   #
+######################################################################
+
+
+from sklearn.feature_extraction import FeatureHasher
+
+
+class HashingDictVectorizer:
+
+    """
+    Maps CliNER feature dicts ({(name,value): weight}) to a fixed number of
+    columns by hashing the feature names. Unlike DictVectorizer it keeps no
+    vocabulary, so it pickles to a few bytes and transform does no lookups.
+    """
+
+    def __init__(self, n_features=2**20):
+        self.n_features = n_features
+        self.hasher = FeatureHasher(n_features=n_features, input_type='dict')
+
+
+    def fit(self, X, y=None):
+        return self
+
+
+    def transform(self, X):
+        return self.hasher.transform( string_keys(x) for x in X )
+
+
+    def fit_transform(self, X, y=None):
+        return self.transform(X)
+
+
+
+def string_keys(features):
+
+    """
+    string_keys()
+
+    Purpose: FeatureHasher needs string keys; join (name,value) tuples
+
+    @param features. A dictionary of features
+    @return          The same dictionary, keyed by strings
+
+    >>> string_keys( {('word','pain'): 1} )
+    {'word=pain': 1}
+    """
+
+    retVal = {}
+    for k,v in features.iteritems():
+        if isinstance(k, tuple):
+            k = '='.join( [ '%s' % f for f in k ] )
+        retVal[k] = v
+    return retVal
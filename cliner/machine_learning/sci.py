@@ -1,6 +1,7 @@
 import numpy as np  
 from sklearn.svm import SVC
 from sklearn.svm import LinearSVC
+from sklearn.linear_model import SGDClassifier
 from sklearn.grid_search import GridSearchCV
 from multiprocessing import cpu_count
 from sklearn.metrics import f1_score
@@ -48,6 +49,28 @@ def train(X, Y, do_grid):
 
 
 
+def train_incremental(batches, classes, n_epochs=5):
+
+    """
+    train_incremental()
+
+    Purpose: Fit a linear SVM (hinge loss, SGD) one batch at a time
+
+    @param batches.  A function returning an iterable of (X, Y) batches
+    @param classes.  Every label that may appear in Y
+    @param n_epochs. Number of passes over the batches
+    @return          The trained classifier
+    """
+
+    clf = SGDClassifier(loss='hinge')
+    for _ in range(n_epochs):
+        for X,Y in batches():
+            clf.partial_fit(X, Y, classes=classes)
+
+    return clf
+
+
+
 def predict(clf, X):
     # Predict
     retVal = list(clf.predict(X))
@@ -0,0 +1,178 @@
+######################################################################
+#  CliNER - vocabulary.py                                            #
+#                                                                    #
+#  Purpose: DictVectorizer replacement whose feature -> column map   #
+#               is a memory-mapped marisa RecordTrie on disk         #
+######################################################################
+
+
+import numpy as np
+import scipy.sparse
+import marisa_trie
+
+
+# Each trie record is the column index of one feature
+RECORD_FORMAT = '<I'
+
+# Separates the parts of a key (the byte 0xFF never occurs in UTF-8)
+SEPARATOR = '\xff'
+
+
+class TrieDictVectorizer:
+
+    """
+    Transform-only vectorizer built from a fitted DictVectorizer's
+    feature names. The vocabulary lives in a mmap'ed trie file, so every
+    process that opens it shares one physical copy and loading costs
+    nothing up front.
+
+    >>> import os, tempfile
+    >>> from sklearn.feature_extraction import DictVectorizer
+    >>> train = [ {('word','pain'):1, ('length',None):4}, {('word','chest'):1} ]
+    >>> test  = [ {(u'word',u'pain'):1, ('length',None):4, (u'word',u'new'):1},
+    ...           {('word','chest'):1, 'dummy':1} ]
+    >>> dvec = DictVectorizer().fit(train)
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'vocab.trie')
+    >>> tvec = TrieDictVectorizer.build(dvec.feature_names_, filename)
+    >>> tvec.transform(test).toarray().tolist() == dvec.transform(test).toarray().tolist()
+    True
+    """
+
+    def __init__(self, filename, n_features, legacy_keys=False):
+        self.filename    = filename
+        self.n_features  = n_features
+        self.legacy_keys = legacy_keys
+        self.key         = legacy_trie_key if legacy_keys else trie_key
+        self.open()
+
+
+    def open(self):
+        self.trie = marisa_trie.RecordTrie(RECORD_FORMAT).mmap(self.filename)
+
+
+    def __getstate__(self):
+        return { 'filename'   : self.filename   ,
+                 'n_features' : self.n_features ,
+                 'legacy_keys': self.legacy_keys }
+
+
+    def __setstate__(self, state):
+        self.__init__( state['filename'], state['n_features'],
+                       state.get('legacy_keys', True) )
+
+
+    @staticmethod
+    def build(feature_names, filename):
+
+        """
+        Write a trie mapping each feature name to its column index
+
+        @param feature_names. DictVectorizer.feature_names_ (column order)
+        @param filename.      Where to save the trie
+        @return               A TrieDictVectorizer over the new trie
+        """
+
+        records = ( (trie_key(f),(i,)) for i,f in enumerate(feature_names) )
+        marisa_trie.RecordTrie(RECORD_FORMAT, records).save(filename)
+        return TrieDictVectorizer(filename, len(feature_names))
+
+
+    def fit(self, X, y=None):
+        return self
+
+
+    def transform(self, X):
+
+        """
+        Same matrix as DictVectorizer.transform (unknown features dropped)
+        """
+
+        indices = []
+        data    = []
+        indptr  = [0]
+        trie    = self.trie
+        key     = self.key
+        for features in X:
+            for k,v in features.iteritems():
+                found = trie.get( key(k) )
+                if found:
+                    indices.append(found[0][0])
+                    data.append(v)
+            indptr.append(len(indices))
+
+        shape = (len(indptr)-1, self.n_features)
+        return scipy.sparse.csr_matrix( (np.array(data, dtype=np.float64),
+                                         np.array(indices, dtype=np.int32),
+                                         np.array(indptr, dtype=np.int32)),
+                                        shape=shape )
+
+
+    def fit_transform(self, X, y=None):
+        return self.transform(X)
+
+
+
+def trie_key(feature):
+
+    """
+    trie_key()
+
+    Purpose: Unambiguous unicode key for a (name,value) feature. Features
+             that are equal as dict keys (so the same DictVectorizer column)
+             get the same key: text is compared as UTF-8, numbers by value.
+
+    >>> trie_key( ('word','pain') ) == trie_key( (u'word',u'pain') )
+    True
+    >>> trie_key( ('word','caf\xc3\xa9') ) == trie_key( ('word',u'caf\xe9') )
+    True
+    >>> trie_key( ('word','None') ) == trie_key( ('word',None) )
+    False
+    >>> trie_key( 'dummy' ) == trie_key( ('dummy',) )
+    False
+    >>> trie_key( ('length',4) ) == trie_key( ('length',4.0) )
+    True
+    """
+
+    if isinstance(feature, tuple):
+        key = 't' + SEPARATOR.join( key_part(p) for p in feature )
+    else:
+        key = 'x' + key_part(feature)
+
+    # Bytes -> unicode one-to-one (marisa keys are unicode)
+    return key.decode('latin-1')
+
+
+
+def key_part(part):
+
+    """ Tagged bytes of one part of a feature (never contains SEPARATOR) """
+
+    if isinstance(part, unicode):
+        return 's' + part.encode('utf-8')
+    if isinstance(part, str):
+        try:
+            part.decode('utf-8')
+            return 's' + part
+        except UnicodeDecodeError:
+            return 'b' + part.encode('hex')
+    if part is None:
+        return 'n'
+    if isinstance(part, (bool, int, long, float)):
+        return 'f' + repr(float(part))
+    return 'r' + key_part(repr(part))[1:]
+
+
+
+def legacy_trie_key(feature):
+
+    """
+    legacy_trie_key()
+
+    Purpose: Key of tries written by bundle version 2 (str and unicode text
+             give different keys)
+
+    >>> legacy_trie_key( ('word','pain') )
+    u"('word', 'pain')"
+    """
+
+    return unicode(repr(feature))
@@ -1,12 +1,20 @@
 from __future__ import with_statement
 
+from bisect import bisect_left
+from itertools import chain
+import multiprocessing
+
 from sklearn.feature_extraction  import DictVectorizer
 
 from features_dir.features import FeatureWrapper
-from features_dir.utilities import load_pickled_obj, prose_sentence
+from features_dir.feature_store import FeatureStore
+from features_dir.utilities import load_pickled_obj
 
 from machine_learning import sci
 from machine_learning import crf
+from machine_learning.hashing import HashingDictVectorizer
+
+import model_bundle
 
 from notes.note import concept_labels, reverse_concept_labels, IOB_labels, reverse_IOB_labels
 
@@ -15,38 +23,116 @@ class Model:
     @staticmethod
     def load(filename='awesome.model'):
 
-        model = load_pickled_obj(filename)
+        # Model bundle (directory) or pickled Model (older models)
+        if model_bundle.is_bundle(filename):
+            model = model_bundle.load_bundle(filename, Model())
+        else:
+            model = load_pickled_obj(filename)
         model.filename = filename
 
+        # Open crfsuite taggers once, rather than once per note
+        model.load_taggers()
+
         return model
 
 
-    def __init__(self, is_crf=True):
+    def __init__(self, is_crf=True, crf_vectorize=True, hash_features=None):
 
         # Use python-crfsuite
         self.crf_enabled = is_crf
 
+        # How pass one features reach crfsuite
+        #   'sparse' - DictVectorizer indices as attribute names
+        #   'dict'   - raw feature dicts (no DictVectorizer for pass one)
+        # Models pickled before this option existed use 'legacy' strings
+        if crf_vectorize:
+            self.crf_format = 'sparse'
+        else:
+            self.crf_format = 'dict'
+
+        # Number of hashed feature columns (None: keep DictVectorizers)
+        self.hash_features = hash_features
+
         # DictVectorizers
-        self.first_prose_vec    = DictVectorizer()
-        self.first_nonprose_vec = DictVectorizer()
-        self.second_vec         = DictVectorizer()
+        if hash_features:
+            self.first_prose_vec    = HashingDictVectorizer(hash_features)
+            self.first_nonprose_vec = HashingDictVectorizer(hash_features)
+            self.second_vec         = HashingDictVectorizer(hash_features)
+        else:
+            self.first_prose_vec    = DictVectorizer()
+            self.first_nonprose_vec = DictVectorizer()
+            self.second_vec         = DictVectorizer()
 
         # Classifiers
         self.first_prose_clf    = None
         self.first_nonprose_clf = None
         self.second_clf         = None
 
+        # Opened crfsuite taggers (not pickled)
+        self.first_prose_tagger    = None
+        self.first_nonprose_tagger = None
+
+
+
+    def __getstate__(self):
+
+        # Taggers wrap C objects; they are rebuilt from the clfs on load
+        state = self.__dict__.copy()
+        state['first_prose_tagger']    = None
+        state['first_nonprose_tagger'] = None
+
+        # A pickle must not depend on a bundle's crfsuite files
+        for name in ['first_prose_clf', 'first_nonprose_clf']:
+            if isinstance(state[name], crf.ModelFile):
+                state[name] = state[name].read()
+
+        return state
+
+
+
+    def save(self, filename):
+
+        """
+        Model::save()
+
+        Purpose: Write the model as a bundle directory (see model_bundle.py)
+
+        @param filename. Path of the bundle directory
+        @return          None
+        """
+
+        model_bundle.save_bundle(self, filename)
+
 
 
-    def train(self, notes, do_grid=False):
+    def load_taggers(self):
+
+        """
+        Model::load_taggers()
+
+        Purpose: Open a crfsuite tagger for each first pass classifier
+
+        @return  None
+        """
+
+        if not self.crf_enabled:
+            return
+
+        self.first_prose_tagger    = crf.CachedTagger(self.first_prose_clf   )
+        self.first_nonprose_tagger = crf.CachedTagger(self.first_nonprose_clf)
+
+
+    def train(self, notes, do_grid=False, n_jobs=1):
 
         """
         Model::train()
 
         Purpose: Train a ML model on annotated data
 
-        @param notes. A list of Note objects (containing text and annotations)
-        @return       None
+        @param notes.   A list of Note objects (containing text and annotations)
+        @param do_grid. A boolean indicating whether to perform a grid search
+        @param n_jobs.  Number of processes used for feature extraction
+        @return         None
         """
 
 
@@ -58,13 +144,13 @@ class Model:
         text    = [  note.getTokenizedSentences()  for  note  in  notes  ]
         ioblist = [  note.getIOBLabels()           for  note  in  notes  ]
 
-        data1 = reduce( concat,    text )
-        Y1    = reduce( concat, ioblist )
+        data1 = list( flatten(    text ) )
+        Y1    = list( flatten( ioblist ) )
 
 
         # Train classifier (side effect - saved as object's member variable)
         print 'first pass'
-        self.first_train(data1, Y1, do_grid)
+        self.first_train(data1, Y1, do_grid, n_jobs)
 
 
 
@@ -77,19 +163,19 @@ class Model:
         indices = [  note.getConceptIndices()  for  note  in  notes  ]
         conlist = [  note.getConceptLabels()   for  note  in  notes  ]
 
-        data2 = reduce( concat, chunks  )
-        inds  = reduce( concat, indices )
-        Y2    = reduce( concat, conlist )
+        data2 = list( flatten( chunks  ) )
+        inds  = list( flatten( indices ) )
+        Y2    = list( flatten( conlist ) )
 
 
         # Train classifier (side effect - saved as object's member variable)
         print 'second pass'
-        self.second_train(data2, inds, Y2, do_grid)
+        self.second_train(data2, inds, Y2, do_grid, n_jobs)
 
 
 
 
-    def first_train(self, data, Y, do_grid=False):
+    def first_train(self, data, Y, do_grid=False, n_jobs=1):
 
         """
         Model::first_train()
@@ -99,6 +185,7 @@ class Model:
         @param data      A list of split sentences    (1 sent = 1 line from file)
         @param Y         A list of list of IOB labels (1:1 mapping with data)
         @param do_grid   A boolean indicating whether to perform a grid search
+        @param n_jobs    Number of processes used for feature extraction
 
         @return          None
         """
@@ -106,8 +193,9 @@ class Model:
         print '\textracting  features (pass one)'
 
 
-        # Create object that is a wrapper for the features
-        feat_obj = FeatureWrapper(data)
+        # Extract features (in parallel, if requested)
+        shards = split_shards(data, n_jobs)
+        extracted = parallel_map(IOB_features_for_shard, shards, n_jobs)
 
 
         # Parition into prose v. nonprose
@@ -115,8 +203,7 @@ class Model:
         nonprose = []
         pchunks = []
         nchunks = []
-        for line,labels in zip(data,Y):
-            isProse,feats = feat_obj.extract_IOB_features(line)
+        for (isProse,feats),labels in zip(flatten(extracted),Y):
             if isProse:
                 prose.append(feats)
                 pchunks += labels
@@ -150,22 +237,24 @@ class Model:
             for i in range(1, len(offsets)):
                 offsets[i] += offsets[i-1]
 
-            # Vectorize features
-            flattened = [item for sublist in fset for item in sublist]
-            X = dvect.fit_transform(flattened)
-            vectorizers.append(dvect)
-
-
-            print '\ttraining classifiers (pass one) ' + flabel
-
-            # CRF needs reconstructed lists
+            # CRF takes per-sentence item sequences
             if self.crf_enabled:
-                X = list(X)
-                X = [ X[i:j] for i, j in zip([0] + offsets, offsets)]
+                if self.crf_format == 'dict':
+                    X = crf.dicts_to_items(fset)
+                else:
+                    flattened = list( flatten(fset) )
+                    X = dvect.fit_transform(flattened)
+                    X = crf.sparse_to_items(X, offsets)
                 Y = [ Y[i:j] for i, j in zip([0] + offsets, offsets)]
                 lib = crf
             else:
+                flattened = list( flatten(fset) )
+                X = dvect.fit_transform(flattened)
                 lib = sci
+            vectorizers.append(dvect)
+
+
+            print '\ttraining classifiers (pass one) ' + flabel
 
             # Train classifiers
             clf  = lib.train(X, Y, do_grid)
@@ -180,13 +269,17 @@ class Model:
         self.first_prose_clf    = classifiers[0]
         self.first_nonprose_clf = classifiers[1]
 
+        # Stale taggers would still hold the previous classifiers
+        self.first_prose_tagger    = None
+        self.first_nonprose_tagger = None
+
 
 
 
     # Model::second_train()
     #
     #
-    def second_train(self, data, inds_list, Y, do_grid=False):
+    def second_train(self, data, inds_list, Y, do_grid=False, n_jobs=1):
 
         """
         Model::second_train()
@@ -204,18 +297,17 @@ class Model:
                            - assertion: there are sum(len(inds_list)) labels
                                AKA each index from inds_list maps to a label
         @param do_grid   A boolean indicating whether to perform a grid search
+        @param n_jobs    Number of processes used for feature extraction
 
         @return          None
         """
 
         print '\textracting  features (pass two)'
 
-        # Create object that is a wrapper for the features
-        feat_o = FeatureWrapper()
-
-        # Extract features
-        X = [ feat_o.concept_features(s,inds) for s,inds in zip(data,inds_list) ]
-        X = reduce(concat, X)
+        # Extract features (in parallel, if requested)
+        shards = split_shards(zip(data,inds_list), n_jobs)
+        X = parallel_map(concept_features_for_shard, shards, n_jobs)
+        X = list( flatten(X) )
 
 
         print '\tvectorizing features (pass two)'
@@ -236,6 +328,170 @@ class Model:
 
 
 
+    def train_stream(self, notes, chunk_size=1000, n_epochs=5):
+
+        """
+        Model::train_stream()
+
+        Purpose: Train a ML model without holding the corpus in memory.
+                 Features are extracted one note at a time into on-disk
+                 feature stores, the CRFs are fed sentence by sentence and
+                 pass two is an SGD linear SVM trained with partial_fit.
+
+        @param notes.      An iterable of Note objects (may be a generator)
+        @param chunk_size. Number of records vectorized at once
+        @param n_epochs.   Number of SGD passes over pass two features
+        @return            None
+        """
+
+        prose_store    = FeatureStore(suffix='prose_features')
+        nonprose_store = FeatureStore(suffix='nonprose_features')
+        concept_store  = FeatureStore(suffix='concept_features')
+
+        # Feature names seen so far (enough to fit each DictVectorizer)
+        # Hashing vectorizers do not need them
+        track_vocab = not self.hash_features
+        prose_vocab    = set()
+        nonprose_vocab = set()
+        concept_vocab  = set()
+
+        try:
+
+            print '\textracting  features (streaming)'
+
+            for note in notes:
+
+                # Pass one: one record per sentence
+                data = note.getTokenizedSentences()
+                feat_obj = FeatureWrapper(data)
+                for line,labels in zip(data, note.getIOBLabels()):
+                    isProse,feats = feat_obj.extract_IOB_features(line)
+                    Y = [ IOB_labels[y] for y in labels ]
+                    if isProse:
+                        store,vocab = prose_store,prose_vocab
+                    else:
+                        store,vocab = nonprose_store,nonprose_vocab
+                    store.append( (feats,Y) )
+                    if track_vocab:
+                        for f in feats:
+                            vocab.update(f)
+
+                # Pass two: one record per concept
+                chunks = note.getChunkedText()
+                inds   = note.getConceptIndices()
+                X = ( feat_obj.concept_features(s,i) for s,i in zip(chunks,inds) )
+                for feats,y in zip(flatten(X), note.getConceptLabels()):
+                    concept_store.append( (feats,concept_labels[y]) )
+                    if track_vocab:
+                        concept_vocab.update(feats)
+
+
+            ##############
+            # First pass #
+            ##############
+
+            print 'first pass'
+
+            flabels = ['prose'             , 'nonprose'             ]
+            stores  = [prose_store         , nonprose_store         ]
+            vocabs  = [prose_vocab         , nonprose_vocab         ]
+            dvects  = [self.first_prose_vec, self.first_nonprose_vec]
+
+            classifiers = []
+            for flabel,store,vocab,dvect in zip(flabels, stores, vocabs, dvects):
+
+                if len(store) == 0:
+                    raise Exception('Training data must have %s training examples' % flabel)
+
+                print '\ttraining classifiers (pass one) ' + flabel
+
+                # Same vocabulary as fitting on every feature dict
+                dvect.fit( [dict.fromkeys(vocab, 1)] )
+
+                if self.crf_enabled:
+                    X = self.stream_crf_items(store, dvect, chunk_size)
+                    Y = ( y for _,y in store.records() )
+                    clf = crf.train(X, Y, False)
+                else:
+                    batches = lambda: self.stream_batches(store, dvect, chunk_size)
+                    clf = sci.train_incremental(batches, IOB_labels.values(), n_epochs)
+                classifiers.append(clf)
+
+            self.first_prose_clf    = classifiers[0]
+            self.first_nonprose_clf = classifiers[1]
+
+            self.first_prose_tagger    = None
+            self.first_nonprose_tagger = None
+
+
+            ###############
+            # Second pass #
+            ###############
+
+            print 'second pass'
+
+            print '\ttraining  classifier (pass two)'
+
+            self.second_vec.fit( [dict.fromkeys(concept_vocab, 1)] )
+            batches = lambda: self.stream_batches(concept_store, self.second_vec, chunk_size)
+            self.second_clf = sci.train_incremental(batches,
+                                                    concept_labels.values(),
+                                                    n_epochs)
+
+        finally:
+            for store in [prose_store, nonprose_store, concept_store]:
+                store.close()
+
+
+
+
+    def stream_crf_items(self, store, dvect, chunk_size):
+
+        """
+        Model::stream_crf_items()
+
+        Purpose: Turn stored (sentence features, labels) records into
+                 crfsuite item sequences, chunk_size sentences at a time
+        """
+
+        for chunk in store.chunks(chunk_size):
+            fset = [ feats for feats,_ in chunk ]
+            if self.crf_format == 'dict':
+                seqs = crf.dicts_to_items(fset)
+            else:
+                offsets = [ len(sublist) for sublist in fset ]
+                for i in range(1, len(offsets)):
+                    offsets[i] += offsets[i-1]
+                X = dvect.transform( flatten(fset) )
+                seqs = crf.sparse_to_items(X, offsets)
+            for xseq in seqs:
+                yield xseq
+
+
+
+
+    def stream_batches(self, store, dvect, chunk_size):
+
+        """
+        Model::stream_batches()
+
+        Purpose: Vectorized (X, Y) batches from a feature store. Sentence
+                 records (list of dicts, list of labels) are flattened to
+                 one row per word.
+        """
+
+        for chunk in store.chunks(chunk_size):
+            if isinstance(chunk[0][0], list):
+                feats  = flatten( f for f,_ in chunk )
+                labels = list( flatten( y for _,y in chunk ) )
+            else:
+                feats  = ( f for f,_ in chunk )
+                labels = [ y for _,y in chunk ]
+            yield dvect.transform(feats), labels
+
+
+
+
     # Model::predict()
     #
     # @param note. A Note object that contains the data
@@ -278,6 +534,90 @@ class Model:
 
 
 
+    def predict_many(self, notes, batch_size=None):
+
+        """
+        Model::predict_many()
+
+        Purpose: Predict concept labels for several notes at once
+
+        @param notes.      A list of Note objects
+        @param batch_size. Max number of notes classified together (None: all)
+        @return            A list of classification lists (1:1 with notes)
+        """
+
+        if not batch_size:
+            batch_size = max(len(notes), 1)
+
+        retVal = []
+        for i in range(0, len(notes), batch_size):
+            retVal += self.predict_batch(notes[i:i+batch_size])
+
+        return retVal
+
+
+
+
+    def predict_batch(self, notes):
+
+        """
+        Model::predict_batch()
+
+        Purpose: Run both passes once over the sentences of all given notes
+
+        @param notes. A list of Note objects
+        @return       A list of classification lists (1:1 with notes)
+        """
+
+        ##############
+        # First pass #
+        ##############
+
+        print 'first pass (%d notes)' % len(notes)
+
+        # Stack every note's sentences; remember where each note ends
+        data    = []
+        offsets = []
+        for note in notes:
+            data += note.getTokenizedSentences()
+            offsets.append(len(data))
+
+        # Predict IOB labels
+        iobs,_,__ = self.first_predict(data)
+
+        for note,i,j in zip(notes, [0] + offsets, offsets):
+            note.setIOBLabels(iobs[i:j])
+
+
+
+        ###############
+        # Second pass #
+        ###############
+
+        print 'second pass (%d notes)' % len(notes)
+
+        chunks = []
+        inds   = []
+        for note in notes:
+            chunks += note.getChunkedText()
+            inds   += note.getConceptIndices()
+
+        # Predict concept labels
+        classifications = self.second_predict(chunks,inds)
+
+
+        # Give each classification back to its note (with local line numbers)
+        starts = [0] + offsets
+        retVal = [ [] for _ in notes ]
+        for concept,lineno,start,end in classifications:
+            k = bisect_left(offsets, lineno)
+            retVal[k].append( (concept,lineno-starts[k],start,end) )
+
+        return retVal
+
+
+
+
     def first_predict(self, data):
 
         """
@@ -310,11 +650,18 @@ class Model:
                 nlinenos.append(i)
 
 
+        # Reuse opened taggers across notes
+        if self.crf_enabled:
+            if not getattr(self, 'first_prose_tagger', None):
+                self.load_taggers()
+            clfs = [self.first_prose_tagger, self.first_nonprose_tagger]
+        else:
+            clfs = [self.first_prose_clf   , self.first_nonprose_clf   ]
+
         # Classify both prose & nonprose
         flabels = ['prose'             , 'nonprose'             ]
         fsets   = [prose               , nonprose               ]
         dvects  = [self.first_prose_vec, self.first_nonprose_vec]
-        clfs    = [self.first_prose_clf, self.first_nonprose_clf]
         preds   = []
 
         for flabel,fset,dvect,clf in zip(flabels, fsets, dvects, clfs):
@@ -332,17 +679,22 @@ class Model:
             for i in range(1, len(offsets)):
                 offsets[i] += offsets[i-1]
 
-            # Vectorize features
-            flattened = [item for sublist in fset for item in sublist]
-            X = dvect.transform(flattened)
+            # CRF takes per-sentence item sequences
+            crf_format = getattr(self, 'crf_format', 'legacy')
+            if self.crf_enabled and (crf_format == 'dict'):
+                X = crf.dicts_to_items(fset)
+            else:
+                # Stream feature dicts into the vectorizer
+                X = dvect.transform( flatten(fset) )
+                if self.crf_enabled and (crf_format == 'sparse'):
+                    X = crf.sparse_to_items(X, offsets)
+                elif self.crf_enabled:
+                    X = crf.legacy_items(X, offsets)
 
 
             print '\tpredicting    labels (pass one) ' + flabel
 
-            # CRF requires reconstruct lists
             if self.crf_enabled:
-                X = list(X)
-                X = [ X[i:j] for i, j in zip([0] + offsets, offsets)]
                 lib = crf
             else:
                 lib = sci
@@ -362,19 +714,14 @@ class Model:
 
         # Stitch prose and nonprose data back together
         # translate IOB labels into a readable format
-        prose_iobs    = []
-        nonprose_iobs = []
-        iobs          = []
         trans = lambda l: reverse_IOB_labels[int(l)]
-        for sentence in data:
-            if prose_sentence(sentence):
-                prose_iobs.append( plist.pop(0) )
-                prose_iobs[-1] = map(trans, prose_iobs[-1])
-                iobs.append( prose_iobs[-1] )
-            else:
-                nonprose_iobs.append( nlist.pop(0) )
-                nonprose_iobs[-1] = map(trans, nonprose_iobs[-1])
-                iobs.append( nonprose_iobs[-1] )
+        prose_iobs    = [ map(trans, p) for p in plist ]
+        nonprose_iobs = [ map(trans, n) for n in nlist ]
+        iobs          = [ None for _ in data ]
+        for i,lineno in enumerate(plinenos):
+            iobs[lineno] = prose_iobs[i]
+        for i,lineno in enumerate(nlinenos):
+            iobs[lineno] = nonprose_iobs[i]
 
 
         # list of list of IOB labels
@@ -399,9 +746,9 @@ class Model:
         print '\textracting  features (pass two)'
 
 
-        # Extract features
-        X = [ feat_o.concept_features(s,inds) for s,inds in zip(data,inds_list) ]
-        X = reduce(concat, X)
+        # Extract features lazily, straight into the vectorizer
+        X = ( feat_o.concept_features(s,inds) for s,inds in zip(data,inds_list) )
+        X = flatten(X)
 
 
         print '\tvectorizing features (pass two)'
@@ -419,7 +766,7 @@ class Model:
 
 
         # Line-by-line processing
-        o = list(out)
+        o = iter(out)
         classifications = []
         for lineno,inds in enumerate(inds_list):
 
@@ -430,7 +777,7 @@ class Model:
             for ind in inds:
 
                 # Get next concept
-                concept = reverse_concept_labels[o.pop(0)]
+                concept = reverse_concept_labels[next(o)]
 
                 # Get start position (ex. 7th word of line)
                 start = 0
@@ -450,8 +797,55 @@ class Model:
 
 
 
-def concat(a,b):
+def split_shards(items, n_jobs):
+    """
+    Split a list into (at most) n_jobs contiguous, order-preserving shards
+    """
+    items = list(items)
+    if n_jobs <= 1:
+        return [items]
+    size = (len(items) + n_jobs - 1) // n_jobs or 1
+    return [ items[i:i+size] for i in range(0, len(items), size) ]
+
+
+
+def parallel_map(func, shards, n_jobs):
+    """
+    map() over shards with a process pool; results stay in shard order
+    """
+    if n_jobs <= 1 or len(shards) <= 1:
+        return map(func, shards)
+
+    pool = multiprocessing.Pool(min(n_jobs, len(shards)))
+    try:
+        return pool.map(func, shards)
+    finally:
+        pool.close()
+        pool.join()
+
+
+
+def IOB_features_for_shard(data):
+    """
+    First pass features for a shard of sentences (worker process entry point)
+    """
+    feat_obj = FeatureWrapper(data)
+    return [ feat_obj.extract_IOB_features(line) for line in data ]
+
+
+
+def concept_features_for_shard(shard):
+    """
+    Second pass features for a shard of (sentence,inds) pairs
+    """
+    feat_o = FeatureWrapper()
+    X = ( feat_o.concept_features(s,inds) for s,inds in shard )
+    return list( flatten(X) )
+
+
+
+def flatten(lists):
     """
-    list concatenation function (for reduce() purpose)
+    linear-time concatenation of a list of lists (lazy; use list() to keep it)
     """
-    return a+b
+    return chain.from_iterable(lists)
@@ -0,0 +1,284 @@
+######################################################################
+#  CliNER - model_bundle.py                                          #
+#                                                                    #
+#  Purpose: Save/load a Model as a versioned directory of raw parts  #
+#               (crfsuite files, .npy weights, vocabularies)         #
+######################################################################
+
+
+import os
+import json
+import shutil
+import marshal
+import cPickle as pickle
+
+import numpy as np
+from sklearn.svm import LinearSVC
+from sklearn.linear_model import SGDClassifier
+from sklearn.feature_extraction import DictVectorizer
+
+import helper
+from machine_learning import crf
+from machine_learning.hashing import HashingDictVectorizer
+
+# Optional: mmap'ed vocabularies (falls back to marshal'ed feature lists)
+try:
+    from machine_learning.vocabulary import TrieDictVectorizer
+except ImportError:
+    TrieDictVectorizer = None
+
+
+# Bump whenever the layout below changes
+#   1 - initial layout
+#   2 - 'trie' vocabularies
+#   3 - trie keys built from UTF-8 parts ('keys':'utf8'; older tries use repr)
+BUNDLE_VERSION = 3
+
+MANIFEST = 'manifest.json'
+
+# Linear classifiers that can be rebuilt from their weights alone
+linear_classifiers = { 'LinearSVC'     : LinearSVC     ,
+                       'SGDClassifier' : SGDClassifier }
+
+# Model attributes that are vectorizers / classifiers
+vectorizer_names = [ 'first_prose_vec', 'first_nonprose_vec', 'second_vec' ]
+classifier_names = [ 'first_prose_clf', 'first_nonprose_clf', 'second_clf' ]
+
+
+
+def is_bundle(path):
+    """ Is the given path a model bundle (rather than a pickled Model)? """
+    return os.path.isfile( os.path.join(path, MANIFEST) )
+
+
+
+def check_path(path):
+
+    """
+    check_path()
+
+    Purpose: Fail (before any training) if a bundle can't be saved at path.
+             An old bundle or an old pickled model there gets replaced;
+             anything else is left alone.
+
+    @param path. Where the bundle is to be written
+    @return      None
+    """
+
+    if os.path.isdir(path) and os.listdir(path) and not is_bundle(path):
+        raise Exception('Cannot save model to %s: it is a directory that is '
+                        'not a model bundle' % path)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    if os.path.exists(parent) and not os.access(parent, os.W_OK):
+        raise Exception('Cannot save model to %s: %s is not writable'
+                        % (path, parent))
+
+
+
+def save_bundle(model, path):
+
+    """
+    save_bundle()
+
+    Purpose: Write a trained Model as a bundle directory. It is written to a
+             temporary sibling first and renamed into place, so readers see
+             either the old model or the whole new one (never a mix).
+
+    @param model. A trained Model
+    @param path.  Directory to create (or replace)
+    @return       None
+    """
+
+    path = os.path.normpath(path)
+    check_path(path)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    helper.mkpath(parent)
+
+    tmp_path = '%s.tmp-%d' % (path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.mkdir(tmp_path)
+
+    try:
+        write_bundle(model, tmp_path)
+    except:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # Swap the new bundle in (the old one may still be mmap'ed; that's fine)
+    old_path = None
+    if os.path.lexists(path):
+        old_path = '%s.old-%d' % (path, os.getpid())
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+
+    if old_path and os.path.isdir(old_path):
+        shutil.rmtree(old_path, ignore_errors=True)
+    elif old_path:
+        os.remove(old_path)
+
+
+
+def write_bundle(model, path):
+
+    """ Write the parts of a bundle into an existing, empty directory """
+
+    manifest = { 'version'       : BUNDLE_VERSION,
+                 'crf_enabled'   : model.crf_enabled,
+                 'crf_format'    : getattr(model, 'crf_format'   , 'legacy'),
+                 'hash_features' : getattr(model, 'hash_features', None    ),
+                 'vectorizers'   : {},
+                 'classifiers'   : {} }
+
+    for name in vectorizer_names:
+        manifest['vectorizers'][name] = save_vectorizer(getattr(model,name),
+                                                        path, name)
+
+    for name in classifier_names:
+        is_crf = model.crf_enabled and name.startswith('first_')
+        manifest['classifiers'][name] = save_classifier(getattr(model,name),
+                                                        path, name, is_crf)
+
+    # Manifest last: a half-written bundle is not mistaken for a good one
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+
+def load_bundle(path, model):
+
+    """
+    load_bundle()
+
+    Purpose: Fill in an (empty) Model from a bundle directory
+
+    @param path.  A bundle directory written by save_bundle()
+    @param model. A freshly constructed Model
+    @return       The same Model
+    """
+
+    with open(os.path.join(path, MANIFEST), 'r') as f:
+        manifest = json.load(f)
+
+    if manifest['version'] > BUNDLE_VERSION:
+        raise Exception('Unsupported model bundle version %s (newest known: %d)'
+                        % (manifest['version'], BUNDLE_VERSION))
+
+    model.crf_enabled   = manifest['crf_enabled'  ]
+    model.crf_format    = manifest['crf_format'   ]
+    model.hash_features = manifest['hash_features']
+
+    for name in vectorizer_names:
+        spec = manifest['vectorizers'][name]
+        setattr(model, name, load_vectorizer(spec, path))
+
+    for name in classifier_names:
+        spec = manifest['classifiers'][name]
+        setattr(model, name, load_classifier(spec, path))
+
+    return model
+
+
+
+def save_vectorizer(vec, path, name):
+
+    if isinstance(vec, HashingDictVectorizer):
+        return { 'type':'hash', 'n_features':vec.n_features }
+
+    # Vocabulary trie (re-saving a loaded model)
+    if TrieDictVectorizer and isinstance(vec, TrieDictVectorizer):
+        filename = name + '.vocab.trie'
+        target = os.path.join(path, filename)
+        if os.path.abspath(vec.filename) != os.path.abspath(target):
+            shutil.copyfile(vec.filename, target)
+        spec = { 'type':'trie', 'file':filename, 'n_features':vec.n_features }
+        if not vec.legacy_keys:
+            spec['keys'] = 'utf8'
+        return spec
+
+    # Unfit vectorizer (e.g. pass one in crfsuite 'dict' mode)
+    if not hasattr(vec, 'feature_names_'):
+        return { 'type':'empty' }
+
+    # Vocabulary as a mmap'able trie
+    if TrieDictVectorizer:
+        filename = name + '.vocab.trie'
+        TrieDictVectorizer.build(vec.feature_names_, os.path.join(path, filename))
+        return { 'type':'trie', 'file':filename, 'keys':'utf8',
+                 'n_features':len(vec.feature_names_) }
+
+    filename = name + '.vocab'
+    with open(os.path.join(path, filename), 'wb') as f:
+        marshal.dump(list(vec.feature_names_), f)
+    return { 'type':'dict', 'file':filename }
+
+
+
+def load_vectorizer(spec, path):
+
+    if spec['type'] == 'hash':
+        return HashingDictVectorizer(spec['n_features'])
+
+    if spec['type'] == 'trie':
+        if not TrieDictVectorizer:
+            raise Exception('marisa_trie is needed to load %s' % spec['file'])
+        return TrieDictVectorizer(os.path.join(path, spec['file']),
+                                  spec['n_features'],
+                                  legacy_keys=(spec.get('keys') != 'utf8'))
+
+    vec = DictVectorizer()
+    if spec['type'] == 'dict':
+        with open(os.path.join(path, spec['file']), 'rb') as f:
+            names = marshal.load(f)
+        vec.feature_names_ = names
+        vec.vocabulary_    = dict( (f,i) for i,f in enumerate(names) )
+    return vec
+
+
+
+def save_classifier(clf, path, name, is_crf):
+
+    # crfsuite model, as the raw file crfsuite itself reads
+    if is_crf:
+        filename = name + '.crfsuite'
+        if isinstance(clf, crf.ModelFile):
+            clf = clf.read()
+        with open(os.path.join(path, filename), 'wb') as f:
+            f.write(clf)
+        return { 'type':'crf', 'file':filename }
+
+    # Linear models: only the weights are needed
+    cls = clf.__class__.__name__
+    if cls in linear_classifiers:
+        files = {}
+        for attr in ['coef_', 'intercept_', 'classes_']:
+            filename = '%s.%s.npy' % (name, attr.strip('_'))
+            np.save(os.path.join(path, filename), getattr(clf, attr))
+            files[attr] = filename
+        return { 'type':'linear', 'class':cls, 'files':files }
+
+    # Anything else (TrivialClassifier, GridSearchCV, ...)
+    filename = name + '.pickle'
+    with open(os.path.join(path, filename), 'wb') as f:
+        pickle.dump(clf, f, -1)
+    return { 'type':'pickle', 'file':filename }
+
+
+
+def load_classifier(spec, path):
+
+    if spec['type'] == 'crf':
+        return crf.ModelFile( os.path.join(path, spec['file']) )
+
+    if spec['type'] == 'linear':
+        clf = linear_classifiers[spec['class']]()
+        for attr,filename in spec['files'].items():
+            # mmap: forked workers share one copy of the weights
+            arr = np.load(os.path.join(path, filename), mmap_mode='r')
+            setattr(clf, attr, arr)
+        return clf
+
+    with open(os.path.join(path, spec['file']), 'rb') as f:
+        return pickle.load(f)
@@ -7,7 +7,6 @@
 ######################################################################
 
 
-import nltk.data
 import re
 
 
@@ -172,6 +171,7 @@ def lno_and_tokspan__to__char_span(line_inds, data, text, lineno, tokspan):
 class SentenceTokenizer:
 
     def __init__(self):
+        import nltk.data
         self.sent_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
 
     def tokenize(self, text_file):
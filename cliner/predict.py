@@ -15,13 +15,15 @@ import os
 import sys
 import glob
 import argparse
+import traceback
+import multiprocessing
 import helper
 
 from model import Model
 from notes.note import Note
 
 
-def main():
+def main(argv=None):
 
     parser = argparse.ArgumentParser()
 
@@ -56,7 +58,42 @@ def main():
       default = None
     )
 
-    args = parser.parse_args()
+    parser.add_argument("-b",
+        dest = "batch_size",
+        help = "Number of notes to classify together",
+        type = int,
+        default = 50
+    )
+
+    parser.add_argument("-w",
+        dest = "workers",
+        help = "Number of worker processes (they share one loaded model)",
+        type = int,
+        default = 1
+    )
+
+    parser.add_argument("-stream",
+        dest = "stream",
+        help = "Read JSON-lines notes on stdin, write predictions to stdout",
+        action = "store_true"
+    )
+
+    parser.add_argument("-latency",
+        dest = "latency",
+        help = "Max milliseconds a streamed note waits for its batch to fill",
+        type = float,
+        default = 50
+    )
+
+    args = parser.parse_args(argv)
+
+
+    # Long-lived stdin/stdout predictor
+    if args.stream:
+        from stream_predict import predict_stream
+        predict_stream(args.model, args.format, batch_size=args.batch_size,
+                       max_latency=args.latency / 1000.0)
+        return
 
 
     # Parse arguments
@@ -66,11 +103,17 @@ def main():
 
 
     # Predict
-    predict(files, args.model, args.output, format=format)
+    predict(files, args.model, args.output, format=format,
+            batch_size=args.batch_size, workers=args.workers)
+
+
+
+# Model shared (copy-on-write) with forked worker processes
+shared_model = None
 
 
 
-def predict(files, model_path, output_dir, format):
+def predict(files, model_path, output_dir, format, batch_size=50, workers=1):
 
     # Must specify output format
     if format not in Note.supportedFormats():
@@ -81,8 +124,9 @@ def predict(files, model_path, output_dir, format):
 
 
 
-    # Load model
-    model = Model.load(model_path)
+    # Load model (before forking, so every worker shares it)
+    global shared_model
+    shared_model = Model.load(model_path)
 
 
     # Tell user if not predicting
@@ -91,38 +135,114 @@ def predict(files, model_path, output_dir, format):
         exit()
 
 
-    # For each file, predict concept labels
+    # Predict concept labels one batch of files at a time
+    files = sorted(files)
+    jobs = [ (files[b:b+batch_size], output_dir, format)
+             for b in range(0, len(files), batch_size) ]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(predict_batch_job, jobs)
+    else:
+        pool = None
+        results = ( predict_batch_job(job) for job in jobs )
+
+
+    # Report progress in file order
     n = len(files)
-    for i,txt in enumerate(sorted(files)):
+    i = 0
+    failed = []
+    for batch_results in results:
+        for txt,out_path,error in batch_results:
+            i += 1
+            print '-' * 30
+            print '\n\t%d of %d' % (i,n)
+            print '\t', txt, '\n'
+            if error:
+                print >>sys.stderr, '\tError: could not predict on %s\n' % txt
+                print >>sys.stderr, error
+                failed.append(txt)
+            else:
+                print '\n\nwriting to: ', out_path
+            print
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    if failed:
+        print >>sys.stderr, '\n\t%d of %d files failed:' % (len(failed),n)
+        for txt in failed:
+            print >>sys.stderr, '\t\t', txt
+        print >>sys.stderr, ''
+
+
+
+def predict_batch_job(job):
+
+    """
+    predict_batch_job()
+
+    Purpose: Predict on a batch of files with the shared model.
+             A file that cannot be read or predicted on is reported
+             rather than aborting the rest of the batch.
+
+    @param job. tuple of (list of txt files, output directory, format)
+    @return     A list of (txt file, output path, error message) tuples
+    """
+
+    batch, output_dir, format = job
+
+    # Read the data into Note objects
+    notes  = []
+    errors = {}
+    for txt in batch:
+        try:
+            note = Note(format)
+            note.read(txt)
+            notes.append( (txt,note) )
+        except Exception:
+            errors[txt] = traceback.format_exc()
+
+    # Predict concept labels (note by note if the batch fails)
+    try:
+        labels_list = shared_model.predict_many( [ n for _,n in notes ] )
+    except Exception:
+        labels_list = []
+        for txt,note in notes:
+            try:
+                labels_list.append( shared_model.predict_many([note])[0] )
+            except Exception:
+                errors[txt] = traceback.format_exc()
+                labels_list.append(None)
 
-        # Read the data into a Note object
-        note = Note(format)
-        note.read(txt)
+    # Output the concept predictions
+    outputs = {}
+    for (txt,note),labels in zip(notes,labels_list):
+        if txt in errors: continue
+        try:
+            outputs[txt] = write_prediction(txt, note, labels, output_dir)
+        except Exception:
+            errors[txt] = traceback.format_exc()
 
+    return [ (txt, outputs.get(txt), errors.get(txt)) for txt in batch ]
 
-        print '-' * 30
-        print '\n\t%d of %d' % (i+1,n)
-        print '\t', txt, '\n'
 
 
-        # Predict concept labels
-        labels = model.predict(note)
+def write_prediction(txt, note, labels, output_dir):
 
-        # Get predictions in proper format
-        extension = note.getExtension()
-        output = note.write(labels)
+    # Get predictions in proper format
+    extension = note.getExtension()
+    output = note.write(labels)
 
-        #print output
+    # Output file
+    fname = os.path.splitext(os.path.basename(txt))[0] + '.' + extension
+    out_path = os.path.join(output_dir, fname)
 
-        # Output file
-        fname = os.path.splitext(os.path.basename(txt))[0] + '.' + extension
-        out_path = os.path.join(output_dir, fname)
+    with open(out_path, 'w') as f:
+        print >>f, output
 
-        # Output the concept predictions
-        print '\n\nwriting to: ', out_path
-        with open(out_path, 'w') as f:
-            print >>f, output
-        print
+    return out_path
 
 
 
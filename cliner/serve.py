@@ -0,0 +1,204 @@
+######################################################################
+#  CliNER - serve.py                                                 #
+#                                                                    #
+#  Purpose: Long-running prediction server. Keeps the model and      #
+#               feature resources loaded between requests.           #
+######################################################################
+
+
+import os
+import sys
+import argparse
+import tempfile
+import urlparse
+import BaseHTTPServer
+
+from model import Model
+from notes.note import Note
+
+
+tmp_dir = os.path.join(os.environ["CLINER_DIR"], "cliner/tmp_files_dir")
+
+# Predicted on at startup, so that loading resources isn't left to a request
+WARM_UP_TEXT = 'The patient was given 10 mg of aspirin for chest pain .\n'
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m",
+        dest = "model",
+        help = "The model to use for prediction",
+        default = os.path.join(os.getenv('CLINER_DIR'), 'models/run.model')
+    )
+
+    parser.add_argument("-f",
+        dest = "format",
+        help = "Default data format ( " + ' | '.join(Note.supportedFormats()) + " )",
+        default = 'i2b2'
+    )
+
+    parser.add_argument("-host",
+        dest = "host",
+        help = "Interface to listen on",
+        default = '127.0.0.1'
+    )
+
+    parser.add_argument("-p",
+        dest = "port",
+        help = "Port to listen on",
+        type = int,
+        default = 8765
+    )
+
+    args = parser.parse_args(argv)
+
+    serve(args.model, args.host, args.port, args.format)
+
+
+
+def read_text(text, format):
+
+    """
+    read_text()
+
+    Purpose: Build a Note from the contents of a txt file
+
+    @param text.   The contents of a note's txt file
+    @param format. Data format of the Note
+    @return        A Note object
+    """
+
+    # Text parsed from JSON is unicode; files hold UTF-8
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+
+    # Notes are read from files
+    fd,tmp_file = tempfile.mkstemp(dir=tmp_dir, suffix="serve_temp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+
+        note = Note(format)
+        note.read(tmp_file)
+        return note
+
+    finally:
+        os.remove(tmp_file)
+
+
+
+def predict_text(model, text, format):
+
+    """
+    predict_text()
+
+    Purpose: Predict concepts for the text of one note
+
+    @param model.  A loaded Model
+    @param text.   The contents of a note's txt file
+    @param format. Output format (same output as Note.write)
+    @return        A string of formatted predictions
+    """
+
+    note = read_text(text, format)
+    labels = model.predict_many([note])[0]
+    return note.write(labels)
+
+
+
+def warm_up(model):
+
+    """
+    warm_up()
+
+    Purpose: Create the feature resources the model uses (POS tagger, UMLS
+             database/tries/cache, GENIA taggers, word cache), which are
+             otherwise only loaded during the first request
+
+    @param model. A loaded Model
+    @return       None
+    """
+
+    print >>sys.stderr, 'loading feature resources'
+    try:
+        predict_text(model, WARM_UP_TEXT, 'i2b2')
+    except Exception, e:
+        # A request would fail the same way; report it but keep serving
+        print >>sys.stderr, 'warm-up prediction failed: %s' % e
+
+
+
+class PredictionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """
+    GET  /health                  ->  'ok'
+    POST /predict?format=<format> ->  predictions for the note in the body
+    """
+
+    def do_GET(self):
+        if urlparse.urlparse(self.path).path == '/health':
+            self.respond(200, 'ok')
+        else:
+            self.respond(404, 'not found')
+
+
+    def do_POST(self):
+
+        url = urlparse.urlparse(self.path)
+        if url.path != '/predict':
+            self.respond(404, 'not found')
+            return
+
+        params = urlparse.parse_qs(url.query)
+        format = params.get('format', [self.server.default_format])[0]
+        if format not in Note.supportedFormats():
+            self.respond(400, 'unsupported format: %s' % format)
+            return
+
+        length = int(self.headers.getheader('content-length') or 0)
+        text = self.rfile.read(length)
+
+        try:
+            output = predict_text(self.server.model, text, format)
+        except Exception, e:
+            self.respond(500, 'prediction failed: %s' % e)
+            return
+
+        self.respond(200, output)
+
+
+    def respond(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+
+def serve(model_path, host='127.0.0.1', port=8765, format='i2b2'):
+
+    # Load model once
+    model = Model.load(model_path)
+
+    # Load the feature resources too, before /health can answer
+    warm_up(model)
+
+    server = BaseHTTPServer.HTTPServer( (host,port), PredictionHandler )
+    server.model          = model
+    server.default_format = format
+
+    print >>sys.stderr, 'serving %s on http://%s:%d' % (model_path,host,port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+######################################################################
+#  CliNER - stream_predict.py                                        #
+#                                                                    #
+#  Purpose: Predict on a stream of JSON-lines notes (stdin/stdout),  #
+#               grouping requests into micro-batches.                #
+######################################################################
+
+
+import sys
+import time
+import json
+import Queue
+import threading
+
+from model import Model
+from notes.note import Note
+from serve import read_text
+
+
+# Marks the end of the input stream
+EOF_MARKER = None
+
+
+class BatchStats:
+
+    """
+    Running statistics: queue depth, batch sizes and request latency
+    """
+
+    def __init__(self):
+        self.batch_sizes  = []
+        self.queue_depths = []
+        self.latencies    = []
+
+    def record(self, batch_size, queue_depth, latencies):
+        self.batch_sizes.append(batch_size)
+        self.queue_depths.append(queue_depth)
+        self.latencies += latencies
+
+    def percentile(self, p):
+        if not self.latencies: return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[ min(len(ordered)-1, int(p / 100.0 * len(ordered))) ]
+
+    def report(self):
+        n = len(self.batch_sizes)
+        if not n:
+            return 'no requests'
+        return ('requests=%d batches=%d mean_batch=%.1f max_queue=%d '
+                'latency_ms p50=%.1f p90=%.1f p99=%.1f'
+                % (len(self.latencies), n, sum(self.batch_sizes) / float(n),
+                   max(self.queue_depths),
+                   1000 * self.percentile(50), 1000 * self.percentile(90),
+                   1000 * self.percentile(99)))
+
+
+
+class MicroBatcher:
+
+    """
+    Collects requests until batch_size are waiting or the oldest one has
+    waited max_latency seconds, then predicts on them with one
+    Model.predict_many call.
+    """
+
+    def __init__(self, model, format, batch_size=32, max_latency=0.05):
+        self.model       = model
+        self.format      = format
+        self.batch_size  = batch_size
+        self.max_latency = max_latency
+        self.queue       = Queue.Queue()
+        self.stats       = BatchStats()
+
+
+    def submit(self, request):
+        """ Queue a request (a dict parsed from one input line) """
+        self.queue.put( (time.time(), request) )
+
+
+    def close(self):
+        """ No more requests will be submitted """
+        self.queue.put( EOF_MARKER )
+
+
+    def batches(self):
+
+        """
+        Generator of batches of (arrival time, request) pairs
+        """
+
+        done = False
+        while not done:
+
+            # Wait for the first request of the batch
+            item = self.queue.get()
+            if item is EOF_MARKER:
+                return
+            batch = [item]
+            deadline = item[0] + self.max_latency
+
+            # Fill the batch until it is full or the oldest request is due
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                if item is EOF_MARKER:
+                    done = True
+                    break
+                batch.append(item)
+
+            yield batch
+
+
+    def run(self, out, report_every=100):
+
+        """
+        Predict on every submitted request (until close()), writing one
+        JSON line per request to out, in input order. Statistics go to
+        stderr every report_every batches.
+        """
+
+        for i,batch in enumerate(self.batches()):
+            depth = self.queue.qsize()
+            responses = self.predict([ request for _,request in batch ])
+            for response in responses:
+                out.write(dump_response(response) + '\n')
+            out.flush()
+
+            now = time.time()
+            self.stats.record(len(batch), depth, [ now-t for t,_ in batch ])
+
+            if report_every and (i+1) % report_every == 0:
+                print >>sys.stderr, self.stats.report()
+
+
+    def predict(self, requests):
+
+        """
+        Predict on a batch of requests
+
+        @param requests. dicts with 'text' and optional 'id' and 'format'
+        @return          dicts with 'id' and either 'output' or 'error'
+        """
+
+        responses = [ {'id':r.get('id') if isinstance(r,dict) else None}
+                      for r in requests ]
+
+        # Read notes (a bad request only fails itself)
+        notes = []
+        for request,response in zip(requests,responses):
+            try:
+                if not isinstance(request, dict):
+                    raise Exception('request must be a JSON object')
+                if 'text' not in request:
+                    raise Exception(request.get('error', 'missing text'))
+                format = request.get('format', self.format)
+                if format not in Note.supportedFormats():
+                    raise Exception('unsupported format: %s' % format)
+                notes.append( (response, read_text(request['text'], format)) )
+            except Exception, e:
+                response['error'] = str(e)
+
+        # One batched prediction (note by note if the batch fails)
+        try:
+            labels_list = self.model.predict_many( [ n for _,n in notes ] )
+        except Exception:
+            labels_list = []
+            for response,note in notes:
+                try:
+                    labels_list.append( self.model.predict_many([note])[0] )
+                except Exception, e:
+                    response['error'] = str(e)
+                    labels_list.append(None)
+
+        # Format the output (a failure only fails its own request)
+        for (response,note),labels in zip(notes,labels_list):
+            if 'error' not in response:
+                try:
+                    response['output'] = note.write(labels)
+                except Exception, e:
+                    response['error'] = str(e)
+
+        return responses
+
+
+
+def dump_response(response):
+
+    """
+    dump_response()
+
+    Purpose: One JSON line for a response (an error line if it won't encode)
+
+    >>> dump_response( {'id':1, 'output':'ok'} ) == json.dumps( {'id':1, 'output':'ok'} )
+    True
+    >>> json.loads( dump_response( {'id':2, 'output':'\\xff'} ) )['id']
+    2
+    """
+
+    try:
+        return json.dumps(response)
+    except (TypeError, ValueError), e:
+        return json.dumps( {'id':response.get('id'), 'error':str(e)} )
+
+
+
+def predict_stream(model_path, format, batch_size=32, max_latency=0.05,
+                   infile=sys.stdin, outfile=sys.stdout):
+
+    """
+    predict_stream()
+
+    Purpose: Read JSON lines from infile, write predictions to outfile.
+             Input lines look like {"id": ..., "text": ..., "format": ...}
+
+    @return  None
+    """
+
+    model = Model.load(model_path)
+
+    batcher = MicroBatcher(model, format, batch_size, max_latency)
+
+    # Model output goes to stderr so stdout stays valid JSON lines
+    real_stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    # Read requests in the background while batches are predicted
+    def reader():
+        try:
+            for line in iter(infile.readline, ''):
+                line = line.strip()
+                if not line: continue
+                try:
+                    request = json.loads(line)
+                except ValueError, e:
+                    request = {'error':'invalid JSON: %s' % e}
+                if not isinstance(request, dict):
+                    request = {'error':'request must be a JSON object'}
+                batcher.submit( request )
+        finally:
+            batcher.close()
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        batcher.run(outfile)
+    finally:
+        sys.stdout = real_stdout
+
+    print >>sys.stderr, batcher.stats.report()
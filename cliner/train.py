@@ -16,15 +16,15 @@ import os.path
 import glob
 import argparse
 import sys
-import cPickle as pickle
 
 import helper
+import model_bundle
 from sets import Set
 from model import Model
 from notes.note import Note
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-t",
@@ -63,8 +63,34 @@ def main():
         action = "store_true"
     )
 
+    parser.add_argument("-no-vec",
+        dest = "novec",
+        help = "A flag indicating whether to give crfsuite raw feature dicts (skips DictVectorizer for pass one).",
+        action = "store_true"
+    )
+
+    parser.add_argument("-hash",
+        dest = "hash_features",
+        help = "Hash features into this many columns instead of keeping a vocabulary",
+        type = int,
+        default = None
+    )
+
+    parser.add_argument("-stream",
+        dest = "stream",
+        help = "A flag indicating whether to stream notes from disk (for corpora larger than memory)",
+        action = "store_true"
+    )
+
+    parser.add_argument("-j",
+        dest = "jobs",
+        help = "Number of processes used for feature extraction",
+        type = int,
+        default = 1
+    )
+
     # Parse the command line arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     is_crf = not args.nocrf
 
 
@@ -86,6 +112,13 @@ def main():
         exit(1)
 
 
+    # Streaming trains on one process, without grid search
+    if args.stream and (args.grid or args.jobs > 1):
+        print >>sys.stderr, '\n\tError: -stream cannot be combined with -g or -j'
+        print >>sys.stderr, ''
+        exit(1)
+
+
     # Collect training data file paths
     txt_files_map = helper.map_files(txt_files) # ex. {'record-13': 'record-13.con'}
     con_files_map = helper.map_files(con_files)
@@ -101,11 +134,29 @@ def main():
 
 
     # Train the model
-    train(training_list, args.model, format, is_crf=is_crf, grid=args.grid)
+    train(training_list, args.model, format, is_crf=is_crf, grid=args.grid,
+          crf_vectorize=not args.novec, n_jobs=args.jobs, stream=args.stream,
+          hash_features=args.hash_features)
+
 
 
+def train(training_list, model_path, format, is_crf=True, grid=False,
+          crf_vectorize=True, n_jobs=1, stream=False, hash_features=None):
 
-def train(training_list, model_path, format, is_crf=True, grid=False):
+    # Fail now rather than after training if the model can't be saved there
+    model_bundle.check_path(model_path)
+
+    # Read notes lazily (one at a time) instead
+    if stream:
+        # Streaming trains with SGD on one process (no grid search, no -j)
+        if grid or n_jobs > 1:
+            print >>sys.stderr, '\n\tError: -stream cannot be combined with -g or -j'
+            print >>sys.stderr, ''
+            return 1
+
+        return train_stream(training_list, model_path, format, is_crf=is_crf,
+                            crf_vectorize=crf_vectorize,
+                            hash_features=hash_features)
 
     # Read the data into a Note object
     notes = []
@@ -122,17 +173,54 @@ def train(training_list, model_path, format, is_crf=True, grid=False):
 
 
     # Create a Machine Learning model
-    model = Model(is_crf=is_crf)
+    model = Model(is_crf=is_crf, crf_vectorize=crf_vectorize,
+                  hash_features=hash_features)
 
 
     # Train the model using the Note's data
-    model.train(notes, grid)
+    model.train(notes, grid, n_jobs=n_jobs)
+
+
+    # Write model bundle
+    print 'saving model'
+    model.save(model_path)
+
+
+
+def read_notes(training_list, format):
+
+    """
+    Generator of Note objects, read one at a time from (txt, con) pairs
+    """
+
+    for txt, con in training_list:
+        note_tmp = Note(format)       # Create Note
+        note_tmp.read(txt, con)       # Read data into Note
+        yield note_tmp
+
+
+
+def train_stream(training_list, model_path, format, is_crf=True,
+                 crf_vectorize=True, hash_features=None):
+
+    # file names
+    if not training_list:
+        print 'Error: Cannot train on 0 files. Terminating train.'
+        return 1
+
+
+    # Create a Machine Learning model
+    model = Model(is_crf=is_crf, crf_vectorize=crf_vectorize,
+                  hash_features=hash_features)
+
+
+    # Train the model one note at a time
+    model.train_stream( read_notes(training_list, format) )
 
 
-    # Pickle dump
-    print 'pickle dump'
-    with open(model_path, "wb") as m_file:
-        pickle.dump(model, m_file)
+    # Write model bundle
+    print 'saving model'
+    model.save(model_path)
 
 
 
@@ -23,3 +23,18 @@ if __name__ == '__main__':
 
     import features_dir.word_features
     doctest.testmod(features_dir.word_features)
+
+    import features_dir.resources
+    doctest.testmod(features_dir.resources)
+
+    import features_dir.word_cache
+    doctest.testmod(features_dir.word_cache)
+
+    import features_dir.umls_dir.umls_cache
+    doctest.testmod(features_dir.umls_dir.umls_cache)
+
+    import features_dir.umls_dir.umls_lexicon
+    doctest.testmod(features_dir.umls_dir.umls_lexicon)
+
+    import features_dir.genia_dir.genia_cache
+    doctest.testmod(features_dir.genia_dir.genia_cache)
@@ -0,0 +1,9 @@
+if __name__ == '__main__':
+    import doctest
+    
+    import os, sys
+    home = os.path.join( os.getenv('CLINER_DIR') , 'cliner' )
+    if home not in sys.path: sys.path.append(home)
+
+    import machine_learning.vocabulary
+    doctest.testmod(machine_learning.vocabulary)
@@ -0,0 +1,54 @@
+"""
+Regression check for word_features.combine(): the feature dicts built from
+the combined regexes are identical to searching every pattern on its own.
+
+>>> import re
+>>> import features_dir.word_features as wf
+>>> from features_dir.word_cache import WordCache
+
+>>> TOKENS = ['Test', 'ABC', 'abc', '7', '42', '1999', '12345', '12.5',
+...           '555-1234', '555-555-1234', 'x-ray', 'A1-2', '3-4', '-', '/',
+...           '...', 'rhythm', 'q.d.', 'qAD', 'bid', 'p.o.', 'PRM', 'units',
+...           'cc', '10 mL', '9ml', '3dL', '1mg', '14 grams', '1mm',
+...           '36 millimeters', '2014-02-19', '03-27-1995', '1-2-333',
+...           'c5-c9', 'C12', 'diagnosis', 'toxic', 'test was 10%',
+...           'Test was positive', 'WBC of 12', 'less than 30', 'Na: 140',
+...           'caf\\xc3\\xa9', u'caf\\xe9', '']
+
+>>> def features():
+...     obj = wf.WordFeatures()
+...     obj.cache = WordCache(size=1000)
+...     return [ ( obj.IOB_prose_features(w), obj.IOB_nonprose_features(w),
+...                obj.concept_features_for_word(w), obj.QANN_features(w) )
+...              for w in TOKENS ]
+
+>>> def searched(patterns, word):
+...     return [ f for f,p in patterns.items() if re.search(p, word) ]
+
+>>> combined = features()
+
+>>> mitre_flags, qann_flags = wf.mitre_flags, wf.qann_flags
+>>> wf.mitre_flags = lambda w: tuple( searched(wf.WordFeatures.mitre_features, w) )
+>>> wf.qann_flags  = lambda w: frozenset( searched(wf.WordFeatures.qann_patterns, w) )
+>>> one_by_one = features()
+>>> wf.mitre_flags, wf.qann_flags = mitre_flags, qann_flags
+
+>>> combined == one_by_one
+True
+>>> ('mitre', 'PHONE2') in combined[ TOKENS.index('555-555-1234') ][0]
+True
+>>> ('metric_unit', 'weight') in combined[ TOKENS.index('14 grams') ][2]
+True
+>>> ('test_result', None) in combined[ TOKENS.index('Test was positive') ][1]
+True
+"""
+
+
+if __name__ == '__main__':
+    import doctest
+
+    import os, sys
+    home = os.path.join( os.getenv('CLINER_DIR') , 'cliner' )
+    if home not in sys.path: sys.path.append(home)
+
+    doctest.testmod()